@@ -0,0 +1,138 @@
+// Clientside callbacks of plots.py, used when it runs with CLIENTSIDE_FILTERING=1.
+// The stores hold hourly counts from compactCube, sorted by the timestamp of
+// the hour, so the rows of a slider range are found by binary search and the
+// bars of the histograms are summed here instead of on the server.
+
+function bisect(values, value, right) {
+    var low = 0, high = values.length;
+    while (low < high) {
+        var middle = (low + high) >> 1;
+        if (values[middle] < value || (right && values[middle] === value)) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+// The resolutions of the histograms over time, as TIME_RESOLUTIONS,
+// TIME_BARS and HOVER_FORMATS in plots.py: the finest one showing the
+// messages of the range in at most TIME_BARS bars is used.
+var TIME_RESOLUTIONS = [["hour", 3600], ["day", 86400], ["week", 7 * 86400], ["month", 30.44 * 86400]];
+var TIME_BARS = 150;
+var HOVER_FORMATS = {hour: "%d %B %Y, %H:00", day: "%A, %d %B %Y", week: "week of %d %B %Y", month: "%B %Y"};
+
+function timeResolution(span) {
+    for (var i = 0; i < TIME_RESOLUTIONS.length; i++) {
+        if (span <= TIME_RESOLUTIONS[i][1] * TIME_BARS) {
+            return TIME_RESOLUTIONS[i][0];
+        }
+    }
+    return TIME_RESOLUTIONS[TIME_RESOLUTIONS.length - 1][0];
+}
+
+// Returns the start of the bucket of a day ("YYYY-MM-DD") and hour as a
+// date string, weeks start on Monday.
+function bucketStart(day, hour, resolution) {
+    if (resolution === "hour") {
+        return day + " " + (hour < 10 ? "0" : "") + hour + ":00";
+    }
+    if (resolution === "month") {
+        return day.slice(0, 8) + "01";
+    }
+    if (resolution === "week") {
+        var date = new Date(day + "T00:00:00Z");
+        date.setUTCDate(date.getUTCDate() - (date.getUTCDay() + 6) % 7);
+        return date.toISOString().slice(0, 10);
+    }
+    return day;
+}
+
+// Sums the counts of the rows in range per series and x value: the hour of
+// the day, or the bucket of the resolution for the span of the rows.
+// Returns {series name: {x: [...], y: [...]}} with the x values in order.
+function sumBars(data, range, byHour) {
+    // the rows are hours stored by their start, the hour the range begins
+    // in is kept whole, as hourRange in plots.py
+    var start = bisect(data.timestamp, range[0] - 3599, false);
+    var end = bisect(data.timestamp, range[1], true);
+    var resolution = end > start ? timeResolution(data.timestamp[end - 1] - data.timestamp[start] + 3600) : "day";
+    var labels = {};
+    var sums = data.names.map(function () { return {}; });
+    for (var i = start; i < end; i++) {
+        var x = data.hour[i];
+        if (!byHour) {
+            var day = data.day[i];
+            if (resolution === "hour") {
+                x = bucketStart(data.days[day], x, resolution);
+            } else {
+                x = labels[day] || (labels[day] = bucketStart(data.days[day], 0, resolution));
+            }
+        }
+        var series = sums[data.series[i]];
+        series[x] = (series[x] || 0) + data.count[i];
+    }
+    var bars = {};
+    data.names.forEach(function (name, code) {
+        var xs = Object.keys(sums[code]);
+        xs = byHour ? xs.map(Number).sort(function (a, b) { return a - b; }) : xs.sort();
+        bars[name] = {
+            x: xs,
+            y: xs.map(function (x) { return sums[code][x]; })
+        };
+    });
+    return {bars: bars, total: end - start, resolution: resolution};
+}
+
+// Returns a copy of a figure drawn by plots.py with the bars of every trace
+// (one per series, named like it) replaced by the sums of the range.
+function updateFigure(figure, data, range, byHour) {
+    var result = sumBars(data, range, byHour);
+    var layout = Object.assign({}, figure.layout, {
+        annotations: result.total === 0 ? [{
+            text: "No messages in this period", showarrow: false,
+            xref: "paper", yref: "paper", x: 0.5, y: 0.5
+        }] : []
+    });
+    layout.yaxis = Object.assign({}, layout.yaxis, {autorange: true});
+    if (!byHour) {
+        layout.xaxis = Object.assign({}, layout.xaxis,
+                                     {autorange: true, hoverformat: HOVER_FORMATS[result.resolution]});
+        layout.yaxis.title = Object.assign({}, layout.yaxis.title,
+                                           {text: "Number of messages per " + result.resolution});
+    }
+    return {
+        data: figure.data.map(function (trace) {
+            var bars = result.bars[trace.name] || {x: [], y: []};
+            return Object.assign({}, trace, {x: bars.x, y: bars.y});
+        }),
+        layout: layout
+    };
+}
+
+// The summary store comes as a json string, encoded once on the server
+// instead of for every page, and is parsed here once.
+var parsedStore = {text: null, data: null};
+function storeData(data) {
+    if (typeof data !== "string") {
+        return data;
+    }
+    if (parsedStore.text !== data) {
+        parsedStore = {text: data, data: JSON.parse(data)};
+    }
+    return parsedStore.data;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    plots: {
+        updateHistograms: function (range, data, timeFigure, hourFigure) {
+            if (!data || !timeFigure || !hourFigure) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            data = storeData(data);
+            return [updateFigure(timeFigure, data, range, false),
+                    updateFigure(hourFigure, data, range, true)];
+        }
+    }
+});
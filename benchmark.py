@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import shutil
+import numpy as np
+
+# Measures generate.py and plots.py on synthetic exports of a few sizes
+# (generate_synthetic.py) and writes the results as json, so runs on
+# different commits can be compared. Every phase runs in its own process,
+# so its peak memory is measured on its own.
+
+basedirectory = os.path.dirname(os.path.abspath(__file__))
+
+
+def peakMemoryMB():
+    ''' Peak resident memory of this process and of its finished children. '''
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def percentiles(times):
+    times = np.array(times) * 1000
+    return {"median_ms": float(np.median(times)), "p95_ms": float(np.percentile(times, 95)),
+            "max_ms": float(times.max()), "runs": len(times)}
+
+
+def phaseGenerate(directory, messages, args):
+    import generate_synthetic
+    options = argparse.Namespace(**vars(args))
+    options.messages = messages
+    options.threads = max(2, min(args.threads, messages // 20))
+    start = time.perf_counter()
+    count = generate_synthetic.generateExport(directory, options)
+    return {"seconds": time.perf_counter() - start, "messages": count}
+
+
+def phaseIngest(directory, args):
+    import generate
+    paths = {name: os.path.join(directory, name + ".parquet") for name in generate.TABLE_SCHEMAS}
+    start = time.perf_counter()
+    count, manifest = generate.ingest(os.path.join(directory, "messages", "inbox"), paths,
+                                      os.path.join(directory, "manifest.json"), workers=args.workers, full=True,
+                                      indexfile=os.path.join(directory, "search_index.arrow"))
+    seconds = time.perf_counter() - start
+    with open(os.path.join(directory, "owner.txt"), "w", encoding="utf-8") as ownerfile:
+        ownerfile.write(manifest["owner"])
+    return {"seconds": seconds, "messages": count, "messages_per_second": count / seconds,
+            "peak_memory_mb": peakMemoryMB(),
+            "output_mb": sum(os.path.getsize(path) for path in paths.values()) / 2**20}
+
+
+def callbackRequest(output, callback, values):
+    ''' Builds the body of a /_dash-update-component request, taking the
+        value of every input and state from values (None if missing).
+    '''
+    def prop(spec):
+        key = spec["id"] + "." + spec["property"]
+        return dict(spec, value=values.get(key))
+
+    if output.startswith(".."):
+        outputs = [dict(zip(("id", "property"), part.rsplit(".", 1))) for part in output[2:-2].split("...")]
+    else:
+        outputs = dict(zip(("id", "property"), output.rsplit(".", 1)))
+    inputs = [prop(spec) for spec in callback["inputs"]]
+    return {"output": output, "outputs": outputs, "inputs": inputs,
+            "state": [prop(spec) for spec in callback["state"]],
+            "changedPropIds": [spec["id"] + "." + spec["property"] for spec in inputs[:1]]}
+
+
+def searchQueries(directory, rng):
+    ''' Picks queries for the search tab from the texts of a sample of the
+        messages: a frequent and a rare word and phrases of two and three
+        words.
+    '''
+    import pyarrow.parquet as pq
+    from tokens import splitWords
+    contents = pq.read_table(os.path.join(directory, "messages.parquet"), columns=["content"]).column("content")
+    contents = contents.drop_null()
+    sample = contents.take(rng.sample(range(len(contents)), min(2000, len(contents)))).to_pandas()
+    words = splitWords(sample)
+    counts = words.value_counts()
+    messages = [list(group) for position, group in words.groupby(level=0) if len(group) >= 3]
+    queries = {"frequent word": counts.index[0], "rare word": counts.index[-1]}
+    for length in (2, 3):
+        message = rng.choice(messages)
+        start = rng.randrange(len(message) - length + 1)
+        queries["phrase of " + str(length)] = " ".join(message[start:start + length])
+    return queries
+
+
+def phaseDashboard(directory, args):
+    ''' Loads the app on the dataset and times every server-side callback
+        through the Flask test client, over random slider ranges.
+    '''
+    start = time.perf_counter()
+    import plots
+    app = plots.createApp(directory)
+    client = app.server.test_client()
+    client.get("/")
+    client.get("/_dash-layout")
+    load = time.perf_counter() - start
+    memory = peakMemoryMB()
+    client.get("/_dash-dependencies")
+    data = plots.registry.get(None)
+
+    rng = random.Random(args.seed)
+    first, last = int(data.df_timestamps[0]), int(data.df_timestamps[-1])
+    ranges = [[first, last]] + [sorted(rng.sample(range(first, last + 1), 2)) for _ in range(args.runs - 1)]
+    sizes = data.df.loc[data.df["thread_type"] == "Regular", "thread_name"].value_counts()
+    person = str(sizes.index[0]) if len(sizes) else None
+
+    def timeCallback(output, callback, query=None):
+        times = []
+        size = 0
+        for range_ in ranges:
+            values = {"year_slider1.value": range_, "person-dropdown.value": person,
+                      "reactions-dropdown.value": person, "tabs.active_tab": "tab1",
+                      "wordcloud-interval.n_intervals": 0, "search-input.value": query}
+            body = callbackRequest(output, callback, values)
+            begin = time.perf_counter()
+            response = client.post("/_dash-update-component", json=body)
+            times.append(time.perf_counter() - begin)
+            size = max(size, len(response.data))
+        return dict(percentiles(times), max_response_bytes=size)
+
+    # the search tab is timed for every kind of query, over the same ranges
+    queries = searchQueries(directory, rng)
+    callbacks = {}
+    for output, callback in app.callback_map.items():
+        if output.startswith("search-container."):
+            for kind, query in queries.items():
+                callbacks[output + " (" + kind + ")"] = dict(timeCallback(output, callback, query), query=query)
+        else:
+            callbacks[output] = timeCallback(output, callback)
+
+    # the wordcloud callback only starts the renders, this times them
+    renders = []
+    for range_ in ranges[:args.wordcloud_runs]:
+        begin = time.perf_counter()
+        children, job, done = plots.updateWordclouds(data, person, range_, False, None)
+        while not done:
+            time.sleep(0.01)
+            children, unused, done = plots.updateWordclouds(data, person, range_, True, job)
+        renders.append(time.perf_counter() - begin)
+    plots.wordcloudPool().shutdown()
+    return {"load_seconds": load, "load_peak_memory_mb": memory, "messages": len(data.df),
+            "dataset_memory_mb": {name: size / 2**20 for name, size in data.memory().items()},
+            "callbacks": callbacks, "wordcloud_render": percentiles(renders) if renders else None}
+
+
+PHASES = {"generate": phaseGenerate, "ingest": phaseIngest, "dashboard": phaseDashboard}
+
+
+def runPhase(phase, directory, args, messages=None):
+    ''' Runs a phase in a new python process and returns its results. '''
+    command = [sys.executable, os.path.abspath(__file__), "--phase", phase, "--directory", directory,
+               "--workers", str(args.workers), "--runs", str(args.runs), "--seed", str(args.seed),
+               "--threads", str(args.threads), "--wordcloud-runs", str(args.wordcloud_runs)]
+    if messages is not None:
+        command += ["--sizes", str(messages)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, cwd=basedirectory).stdout
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=basedirectory, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks generate.py and plots.py on synthetic exports")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000, 10000000],
+                        help="numbers of messages to benchmark (default: 10000 1000000 10000000)")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="where to write the results (default: benchmark_results.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="generate.py workers (default: number of cpus)")
+    parser.add_argument("--runs", type=int, default=20, help="calls of every callback (default: 20)")
+    parser.add_argument("--wordcloud-runs", type=int, default=3, help="wordclouds rendered (default: 3)")
+    parser.add_argument("--threads", type=int, default=200, help="conversations of the exports (default: 200)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--keep", help="keep the generated exports in this directory")
+    parser.add_argument("--phase", choices=PHASES, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        if args.phase == "generate":
+            import generate_synthetic
+            defaults = argparse.ArgumentParser()
+            generate_synthetic.addArguments(defaults)
+            options = defaults.parse_args([])
+            options.seed = args.seed
+            options.threads = args.threads
+            result = phaseGenerate(args.directory, args.sizes[0], options)
+        else:
+            result = PHASES[args.phase](args.directory, args)
+        # stdout of the phase process is its result, the last line
+        print(json.dumps(result))
+        return
+
+    results = {"commit": gitCommit(), "python": platform.python_version(), "platform": platform.platform(),
+               "cpus": os.cpu_count(), "workers": args.workers, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "sizes": []}
+    workdir = args.keep or tempfile.mkdtemp(prefix="benchmark")
+    for messages in args.sizes:
+        directory = os.path.join(workdir, str(messages))
+        os.makedirs(directory, exist_ok=True)
+        print("Rozmiar " + str(messages) + ": generowanie", file=sys.stderr)
+        size = {"messages": messages, "generate": runPhase("generate", directory, args, messages)}
+        print("Rozmiar " + str(messages) + ": generate.py", file=sys.stderr)
+        size["ingest"] = runPhase("ingest", directory, args)
+        print("Rozmiar " + str(messages) + ": plots.py", file=sys.stderr)
+        size["dashboard"] = runPhase("dashboard", directory, args)
+        results["sizes"].append(size)
+        with open(args.output, "w", encoding="utf-8") as outputfile:
+            json.dump(results, outputfile, indent=2)
+    if not args.keep:
+        shutil.rmtree(workdir)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
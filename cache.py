@@ -0,0 +1,176 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    ''' A least recently used cache whose budget is the total size of the
+        stored values in bytes (values are str or bytes payloads).
+        Counts hits and misses so the budget can be sized from real use.
+    '''
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count=True):
+        ''' Returns the cached value or None. Lookups with count=False (e.g.
+            polling for a result) are not counted as hits or misses.
+        '''
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += count
+                return None
+            self.items.move_to_end(key)
+            self.hits += count
+            return value
+
+    def put(self, key, value):
+        ''' Stores a value, evicting the least recently used ones until it
+            fits. Values larger than the whole budget are not stored.
+        '''
+        size = len(value)
+        if size > self.maxbytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key))
+            while self.items and self.size + size > self.maxbytes:
+                oldkey, oldvalue = self.items.popitem(last=False)
+                self.size -= len(oldvalue)
+                self.evictions += 1
+            self.items[key] = value
+            self.size += size
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self.items), "bytes": self.size, "maxbytes": self.maxbytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": self.hits / requests if requests else 0.0}
+
+
+class DiskCache:
+    ''' A cache of bytes payloads in the files of a directory, so it outlives
+        the process. Its budget is the total size of the files: when a new
+        one does not fit, the least recently used ones (by modification
+        time, which reads refresh) are deleted. Several processes can share
+        the directory: files are written under a temporary name and renamed,
+        and the size is counted again from the directory before evicting.
+        Eviction goes down to LOW_WATER of the budget, so the directory is
+        not scanned again on every write once the cache is full.
+        Failing reads and writes are ignored, it is only a cache.
+    '''
+
+    LOW_WATER = 0.9
+    # temporary files older than this were left by writers that crashed
+    STALE_SECONDS = 3600
+
+    def __init__(self, directory, maxbytes):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for path, mtime, size in self.files())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + suffix)
+
+    def files(self):
+        ''' Returns (path, mtime, size) of every cached file, deleting the
+            stale temporary files on the way.
+        '''
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return files
+        stale = time.time() - self.STALE_SECONDS
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    if stat.st_mtime < stale:
+                        os.remove(entry.path)
+                    continue
+            except OSError:
+                # deleted by another process meanwhile
+                continue
+            files.append((entry.path, stat.st_mtime, stat.st_size))
+        return files
+
+    def get(self, key, suffix=""):
+        ''' Returns the value stored under a str key, or None. '''
+        path = self.path(key, suffix)
+        try:
+            with open(path, "rb") as cachefile:
+                value = cachefile.read()
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value, suffix=""):
+        ''' Stores a value, evicting the least recently used files until it
+            fits. Values larger than the whole budget are not stored.
+        '''
+        size = len(value)
+        if size > self.maxbytes:
+            return
+        path = self.path(key, suffix)
+        with self.lock:
+            if self.size + size > self.maxbytes:
+                self.evict(int(self.maxbytes * self.LOW_WATER) - size)
+            self.size += size
+        tmpfile = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmpfile, "wb") as cachefile:
+                cachefile.write(value)
+            os.replace(tmpfile, path)
+        except OSError:
+            try:
+                os.remove(tmpfile)
+            except OSError:
+                pass
+
+    def evict(self, limit):
+        ''' Deletes the least recently used files until the rest take at
+            most limit bytes. Called with the lock held.
+        '''
+        files = sorted(self.files(), key=lambda file: file[1])
+        total = sum(size for path, mtime, size in files)
+        for path, mtime, size in files:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"directory": self.directory, "bytes": self.size, "maxbytes": self.maxbytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": self.hits / requests if requests else 0.0}
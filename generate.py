@@ -1,77 +1,991 @@
 import os
 import json
-import datetime
+import time
+import argparse
+import hashlib
+import io
+import re
+import zipfile
+import hmac
+import secrets
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tokens import tokenizeColumn, tokenizePositions
 
-basefile = os.path.dirname(os.path.abspath(__file__))
-root = os.path.join(basefile, "messages", "inbox")
-message_id = 1
-output = []
-owner = ""
-reactions = []
-
-for thread in os.listdir(root):
-    for messagefile in os.listdir(os.path.join(root, thread)):
-        if (messagefile.endswith("json")):
-            filepath = os.path.join(root,thread, messagefile)
-            with open(filepath) as jsonfile:
-                data = json.load(jsonfile)
-                numberofpeople = len(data["participants"])
-                threadtype = data["thread_type"].encode('iso-8859-1').decode('utf-8')
-                threadname = data['title'].encode('iso-8859-1').decode('utf-8')
-                messages = data["messages"]
-                if owner == "" and data["thread_type"] == "Regular" and len(data["participants"])>1:
-                    owner = data["participants"][1]["name"].encode('iso-8859-1').decode('utf-8')
-                for message in messages:
-                    if (message["type"] == "Generic"):
-                        author = message["sender_name"].encode('iso-8859-1').decode('utf-8')
-                        dt = datetime.datetime.fromtimestamp(message["timestamp_ms"]//1000)
-                        whole_date = dt.isoformat()
-                        year = dt.year
-                        month = dt.month
-                        day = dt.day
-                        hour = dt.hour
-                        minute = dt.minute
-                        second = dt.second
-                        chars = 0
-                        words = 0
-                        react = message.get("reactions")
-                        if react:
-                            for reaction in react:
-                                actor = reaction['actor'].encode('iso-8859-1').decode('utf-8')
-                                emoji = reaction['reaction'].encode('iso-8859-1').decode('utf-8')
-                                reactions.append([message_id, threadtype, numberofpeople, threadname, author,
-                                                  whole_date, year, month, day, hour, minute, second, emoji, actor])
-                        content = message.get("content")
-                        if content:
-                            enc = content.encode('iso-8859-1').decode('utf-8')
-                            chars = len(content)
-                            words = len(content.split(" "))
-                        output.append([message_id, threadtype, numberofpeople, threadname, author, whole_date,
-                                       year, month, day, hour, minute, second, chars, words, enc])
-                        message_id+=1
-
-df = pd.DataFrame(output, columns=["id", "thread_type", "number_of_people", "thread_name", "author", "date", "year",
-                                   "month", "day", "hour", "minute", "second", "chars", "words", "content"])
-
-df_reactions = pd.DataFrame(reactions, columns=["id", "thread_type", "number_of_people", "thread_name",
-                                                "message_author", "date", "year",  "month", "day", "hour",
-                                                "minute", "second", "emoji", "reacting_person"])
-
-owfilepath = os.path.join(basefile, "owner.txt")
-with open(owfilepath , "w", encoding="utf-8") as ownerfile:
-    ownerfile.write(owner)
-
-
-print(df.head())
-
-messagefile = os.path.join(basefile, "messages.csv")
-reactionsfile = os.path.join(basefile, "reactions.csv")
-
-df.to_csv(messagefile, index=False)
-df_reactions.to_csv(reactionsfile, index=False)
-print(str(len(df))+ " wiadomości")
+# ijson lets us parse the messages array incrementally instead of loading
+# the whole file, without it we fall back to json.load
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
+# with several workers the threads are parsed in about this many batches per
+# worker, a few so that the workers finish at about the same time
+BATCHES_PER_WORKER = 4
 
+# the source of a worker process, see initWorker
+worker_source = None
 
+# dictionary encoded strings are loaded by pandas as categoricals
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
 
+MESSAGE_SCHEMA = pa.schema([
+    ("id", pa.int64()), ("thread_type", CATEGORY), ("number_of_people", pa.int16()), ("thread_name", CATEGORY),
+    ("author", CATEGORY), ("timestamp", pa.int64()), ("year", pa.int16()), ("month", pa.int8()),
+    ("day", pa.int8()), ("hour", pa.int8()), ("minute", pa.int8()), ("second", pa.int8()),
+    ("chars", pa.int32()), ("words", pa.int32()), ("content", pa.string())])
+
+REACTION_SCHEMA = pa.schema([
+    ("id", pa.int64()), ("thread_type", CATEGORY), ("number_of_people", pa.int16()), ("thread_name", CATEGORY),
+    ("message_author", CATEGORY), ("timestamp", pa.int64()), ("year", pa.int16()), ("month", pa.int8()),
+    ("day", pa.int8()), ("hour", pa.int8()), ("minute", pa.int8()), ("second", pa.int8()),
+    ("emoji", CATEGORY), ("reacting_person", CATEGORY)])
+
+# word counts per file, thread, author and local day (the timestamp of its
+# start), id is the id of the first message of the file they come from
+TOKEN_SCHEMA = pa.schema([
+    ("id", pa.int64()), ("thread_name", CATEGORY), ("author", CATEGORY), ("timestamp", pa.int64()),
+    ("token", CATEGORY), ("count", pa.int32())])
+
+# every word of every message with its position in the message, for the
+# search index (see buildSearchIndex)
+POSTING_SCHEMA = pa.schema([
+    ("id", pa.int64()), ("thread_name", CATEGORY), ("timestamp", pa.int64()), ("token", CATEGORY),
+    ("position", pa.int32())])
+
+# the postings of a chunk sorted for the search index, with the words and
+# threads as codes into the sorted lists of all of them (see buildSearchIndex)
+RUN_SCHEMA = pa.schema([
+    ("token", pa.int32()), ("timestamp", pa.int64()), ("id", pa.int64()), ("thread_name", pa.int32()),
+    ("position", pa.int32())])
+
+INDEX_SCHEMA = pa.schema([
+    ("token", CATEGORY), ("timestamp", pa.int64()), ("id", pa.int64()), ("thread_name", CATEGORY),
+    ("position", pa.int32())])
+
+# the fewest rows read at once from every sorted run while merging them
+MERGE_ROWS = 128
+
+TABLE_SCHEMAS = {"messages": MESSAGE_SCHEMA, "reactions": REACTION_SCHEMA, "tokens": TOKEN_SCHEMA,
+                 "postings": POSTING_SCHEMA}
+
+# joins the strings of a column for fixEncodingColumn, it does not occur in
+# real messages and decodes to itself
+ENCODING_SEPARATOR = "\x00"
+
+# the columns holding names of people (and of conversations, which are
+# often named after a person), replaced by pseudonyms by Anonymizer
+ANONYMIZED_COLUMNS = {"messages": ["thread_name", "author"],
+                      "reactions": ["thread_name", "message_author", "reacting_person"],
+                      "tokens": ["thread_name", "author"],
+                      "postings": ["thread_name"]}
+
+# number of rows kept in memory before they are written out
+CHUNK_SIZE = 100000
+
+# bumped whenever the layout of the outputs changes, forcing a full re-ingest
+MANIFEST_VERSION = 8
+
+
+def fixEncoding(text):
+    ''' Facebook exports utf-8 text as latin-1 escapes, this reverses it. '''
+    return text.encode('iso-8859-1').decode('utf-8')
+
+
+def fixEncodingColumn(values):
+    ''' fixEncoding for a whole column at once: the strings are joined,
+        converted with a single encode/decode and split again. None values
+        are kept.
+    '''
+    present = [value for value in values if value is not None]
+    fixed = None
+    try:
+        fixed = ENCODING_SEPARATOR.join(present).encode('iso-8859-1').decode('utf-8').split(ENCODING_SEPARATOR)
+    except UnicodeError:
+        pass
+    if fixed is None or len(fixed) != len(present):
+        # a string contained the separator or was not valid mojibake
+        fixed = [fixEncoding(value) for value in present]
+    if len(present) == len(values):
+        return fixed
+    fixed = iter(fixed)
+    return [next(fixed) if value is not None else None for value in values]
+
+
+def categoryArray(values, fix=True):
+    ''' Dictionary encodes a column of repeated strings, fixing the
+        encoding of every distinct value only once.
+    '''
+    categorical = pd.Categorical(values)
+    categories = list(categorical.categories)
+    if fix:
+        categories = fixEncodingColumn(categories)
+    codes = categorical.codes.astype("int32")
+    return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), pa.array(categories, type=pa.string()))
+
+
+def localOffsets(timestamps):
+    ''' Returns the local utc offset (in seconds) of every unix timestamp.
+        Offsets (and so their changes) are whole quarters of an hour, also
+        in zones like Asia/Kathmandu or America/St_Johns, so the offset is
+        looked up once per distinct quarter instead of once per message.
+    '''
+    quarters, inverse = np.unique(timestamps // 900, return_inverse=True)
+    offsets = np.array([time.localtime(int(quarter) * 900).tm_gmtoff for quarter in quarters], dtype="int64")
+    return offsets[inverse.reshape(-1)]
+
+
+def localMidnights(timestamps):
+    ''' Returns the unix timestamp of the local midnight before every unix
+        timestamp, the way plots.dayStart does. A day is not always 24 hours
+        long, so every distinct local date is converted back with mktime,
+        once per date.
+    '''
+    days, inverse = np.unique((timestamps + localOffsets(timestamps)) // 86400, return_inverse=True)
+    midnights = np.array([int(time.mktime(np.datetime64(int(day), "D").item().timetuple())) for day in days],
+                         dtype="int64")
+    return midnights[inverse.reshape(-1)]
+
+
+def splitTimestamps(timestamps):
+    ''' Breaks unix timestamps (in seconds) into local date parts, the way
+        datetime.fromtimestamp does, but for a whole column at once.
+    '''
+    local = timestamps + localOffsets(timestamps)
+    dates = local.astype("datetime64[s]")
+    months = dates.astype("datetime64[M]")
+    return {"year": dates.astype("datetime64[Y]").astype("int64") + 1970,
+            "month": months.astype("int64") % 12 + 1,
+            "day": (dates.astype("datetime64[D]") - months).astype("int64") + 1,
+            "hour": local % 86400 // 3600,
+            "minute": local % 3600 // 60,
+            "second": local % 60}
+
+
+def buildMessages(rows):
+    ''' Turns raw message rows, as collected from the json, into a table
+        of MESSAGE_SCHEMA.
+    '''
+    ids, threadtypes, numberofpeople, threadnames, authors, timestamps, contents, sources = zip(*rows)
+    timestamps = np.array(timestamps, dtype="int64") // 1000
+    parts = splitTimestamps(timestamps)
+    raw = pd.Series(contents, dtype=object)
+    columns = {"id": pa.array(ids, type=pa.int64()),
+               "thread_type": categoryArray(threadtypes, fix=False),
+               "number_of_people": pa.array(numberofpeople, type=pa.int16()),
+               "thread_name": categoryArray(threadnames, fix=False),
+               "author": categoryArray(authors),
+               "timestamp": pa.array(timestamps),
+               "chars": pa.array(raw.str.len().fillna(0).astype("int32")),
+               "words": pa.array((raw.str.count(" ") + 1).fillna(0).astype("int32")),
+               "content": pa.array(fixEncodingColumn(contents), type=pa.string())}
+    for name, values in parts.items():
+        columns[name] = pa.array(values).cast(MESSAGE_SCHEMA.field(name).type)
+    return pa.Table.from_arrays([columns[name] for name in MESSAGE_SCHEMA.names], schema=MESSAGE_SCHEMA)
+
+
+def buildReactions(rows):
+    ''' Turns raw reaction rows into a table of REACTION_SCHEMA. '''
+    ids, threadtypes, numberofpeople, threadnames, authors, timestamps, emojis, actors = zip(*rows)
+    timestamps = np.array(timestamps, dtype="int64") // 1000
+    parts = splitTimestamps(timestamps)
+    columns = {"id": pa.array(ids, type=pa.int64()),
+               "thread_type": categoryArray(threadtypes, fix=False),
+               "number_of_people": pa.array(numberofpeople, type=pa.int16()),
+               "thread_name": categoryArray(threadnames, fix=False),
+               "message_author": categoryArray(authors),
+               "timestamp": pa.array(timestamps),
+               "emoji": categoryArray(emojis),
+               "reacting_person": categoryArray(actors)}
+    for name, values in parts.items():
+        columns[name] = pa.array(values).cast(REACTION_SCHEMA.field(name).type)
+    return pa.Table.from_arrays([columns[name] for name in REACTION_SCHEMA.names], schema=REACTION_SCHEMA)
+
+
+def buildTokens(rows, messages):
+    ''' Counts the words of a built chunk of messages per source file,
+        thread, author and day, so the wordclouds never have to tokenize
+        the raw text again.
+    '''
+    frame = messages.select(["thread_name", "author", "timestamp", "content"]).to_pandas()
+    frame["id"] = [row[-1] for row in rows]
+    frame["timestamp"] = localMidnights(frame["timestamp"].to_numpy())
+    words = tokenizeColumn(frame["content"].dropna())
+    frame = frame.loc[words.index, ["id", "thread_name", "author", "timestamp"]]
+    frame["token"] = words.to_numpy()
+    counts = frame.groupby(["id", "thread_name", "author", "timestamp", "token"], observed=True, sort=False).size()
+    counts = counts.reset_index(name="count")
+    counts["token"] = counts["token"].astype("category")
+    return pa.Table.from_pandas(counts, schema=TOKEN_SCHEMA, preserve_index=False)
+
+
+def buildPostings(rows, messages):
+    ''' Lists the words of a built chunk of messages with their positions,
+        tokenized like the wordclouds.
+    '''
+    frame = messages.select(["id", "thread_name", "timestamp", "content"]).to_pandas()
+    words = tokenizePositions(frame["content"].dropna())
+    frame = frame.loc[words.index, ["id", "thread_name", "timestamp"]]
+    frame["token"] = pd.Categorical(words["token"].to_numpy())
+    frame["position"] = words["position"].to_numpy()
+    return pa.Table.from_pandas(frame, schema=POSTING_SCHEMA, preserve_index=False)
+
+
+def sortRun(batch, words, threads):
+    ''' Returns a batch of postings sorted by word and then by time, as a
+        table of RUN_SCHEMA, with the codes of the words and threads in the
+        sorted arrays of all of them.
+    '''
+    tokens, threadnames = batch.column("token"), batch.column("thread_name")
+    codes = pc.index_in(tokens.dictionary, value_set=words).to_numpy()[tokens.indices.to_numpy()]
+    threadnames = pc.index_in(threadnames.dictionary, value_set=threads).to_numpy()[threadnames.indices.to_numpy()]
+    timestamps = batch.column("timestamp").to_numpy()
+    rows = np.lexsort((timestamps, codes))
+    return pa.table({"token": codes[rows], "timestamp": timestamps[rows],
+                     "id": batch.column("id").to_numpy()[rows], "thread_name": threadnames[rows],
+                     "position": batch.column("position").to_numpy()[rows]}, schema=RUN_SCHEMA)
+
+
+def mergeRuns(reader, runs, bounds):
+    ''' Merges sorted runs, given as [first, last) ranges of the record
+        batches of reader, yielding for every range of word codes between
+        consecutive bounds its postings in order of word and time. Only a
+        batch of every run is held at a time.
+    '''
+    blocks = [None] * len(runs)
+    for end in bounds[1:]:
+        pieces = []
+        for run, (first, last) in enumerate(runs):
+            while blocks[run] is not None or first < last:
+                if blocks[run] is None:
+                    batch = reader.get_batch(first)
+                    blocks[run] = (batch, batch.column("token").to_numpy())
+                    first += 1
+                    runs[run] = (first, last)
+                batch, codes = blocks[run]
+                stop = int(np.searchsorted(codes, end))
+                pieces.append(batch.slice(0, stop))
+                if stop < len(codes):
+                    blocks[run] = (batch.slice(stop), codes[stop:])
+                    break
+                blocks[run] = None
+        rows = pa.Table.from_batches(pieces, schema=RUN_SCHEMA).combine_chunks()
+        if rows.num_rows == 0:
+            continue
+        # the pieces come in the order of the runs, so a stable sort keeps
+        # the postings of the same word and second in the order of the file
+        order = np.lexsort((rows.column("timestamp").to_numpy(), rows.column("token").to_numpy()))
+        yield rows.take(pa.array(order))
+
+
+def buildSearchIndex(postingsfile, indexfile, chunk_size=CHUNK_SIZE):
+    ''' Writes the inverted index of the messages: the postings sorted by
+        word and then by time, as an uncompressed Arrow file that plots.py
+        memory maps. The dictionary of the token column is sorted too, so a
+        word is found by binary search in it and its postings are a
+        contiguous run of rows (of one record batch, the batches share the
+        dictionaries). Every chunk of postings is sorted on its own into a
+        run in a temporary file, and the runs are merged a range of words
+        with about chunk_size postings at a time, so only about that many
+        are in memory (and at least MERGE_ROWS of every run, or all postings
+        of the most frequent word if they are more).
+    '''
+    postings = pq.ParquetFile(postingsfile)
+    words = threads = pa.array([], type=pa.string())
+    for batch in postings.iter_batches(batch_size=chunk_size, columns=["token", "thread_name"]):
+        words = pc.unique(pa.concat_arrays([words, batch.column("token").dictionary]))
+        threads = pc.unique(pa.concat_arrays([threads, batch.column("thread_name").dictionary]))
+    words, threads = words.sort(), threads.sort()
+
+    # a batch of every run is read at once, together about chunk_size rows
+    runcount = (postings.metadata.num_rows + chunk_size - 1) // chunk_size + postings.metadata.num_row_groups
+    blockrows = max(chunk_size // max(runcount, 1), MERGE_ROWS)
+    runsfile = indexfile + ".runs"
+    try:
+        runs = []
+        counts = np.zeros(len(words), dtype="int64")
+        with pa.OSFile(runsfile, "wb") as sink:
+            with pa.ipc.new_file(sink, RUN_SCHEMA) as writer:
+                batches = 0
+                for batch in postings.iter_batches(batch_size=chunk_size):
+                    if batch.num_rows == 0:
+                        continue
+                    run = sortRun(batch, words, threads)
+                    counts += np.bincount(run.column("token").to_numpy(), minlength=len(words))
+                    writer.write_table(run, max_chunksize=blockrows)
+                    # written as batches of blockrows rows, the last one shorter
+                    runs.append((batches, batches + (batch.num_rows + blockrows - 1) // blockrows))
+                    batches = runs[-1][1]
+
+        # the ranges of word codes merged at once, the postings of a word
+        # are never split
+        total = np.cumsum(counts)
+        cuts = np.searchsorted(total, np.arange(chunk_size, total[-1] if len(total) else 0, chunk_size),
+                               side="right")
+        bounds = np.unique(np.concatenate([[0], cuts, [len(words)]]))
+        with pa.OSFile(runsfile, "rb") as source, pa.OSFile(indexfile + ".tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, INDEX_SCHEMA) as writer:
+                for rows in mergeRuns(pa.ipc.open_file(source), runs, bounds):
+                    writer.write_batch(pa.record_batch([
+                        pa.DictionaryArray.from_arrays(rows.column("token").chunk(0), words),
+                        rows.column("timestamp").chunk(0), rows.column("id").chunk(0),
+                        pa.DictionaryArray.from_arrays(rows.column("thread_name").chunk(0), threads),
+                        rows.column("position").chunk(0)], schema=INDEX_SCHEMA))
+    finally:
+        if os.path.exists(runsfile):
+            os.remove(runsfile)
+    os.replace(indexfile + ".tmp", indexfile)
+
+
+class Anonymizer:
+    ''' A table transform replacing the names in ANONYMIZED_COLUMNS with
+        pseudonyms, person_ and the start of a keyed hash of the name. The
+        same name always gets the same pseudonym for the same key, in any
+        table and any run, and without the key the names cannot be guessed
+        back from the pseudonyms. Only the dictionaries of the columns are
+        mapped, so it costs one lookup per distinct name in a chunk.
+    '''
+
+    def __init__(self, key):
+        self.key = key.encode("ascii")
+        self.pseudonyms = {}
+        self.names = {}
+
+    def pseudonym(self, name):
+        pseudonym = self.pseudonyms.get(name)
+        if pseudonym is None:
+            digest = hmac.new(self.key, name.encode("utf-8"), hashlib.sha256).hexdigest()
+            length = 10
+            # on the (unlikely) collision of two prefixes the later name
+            # gets a longer one
+            while self.names.get(digest[:length], name) != name:
+                length += 2
+            pseudonym = "person_" + digest[:length]
+            self.pseudonyms[name] = pseudonym
+            self.names[digest[:length]] = name
+        return pseudonym
+
+    def __call__(self, name, table):
+        for column in ANONYMIZED_COLUMNS[name]:
+            index = table.schema.get_field_index(column)
+            chunks = [pa.DictionaryArray.from_arrays(chunk.indices, pa.array(
+                          [self.pseudonym(value) for value in chunk.dictionary.to_pylist()], type=pa.string()))
+                      for chunk in table.column(index).chunks]
+            table = table.set_column(index, column, pa.chunked_array(chunks, type=CATEGORY))
+        return table
+
+
+def loadAnonymizer(keyfile):
+    ''' Returns an Anonymizer with the key stored in keyfile, creating a
+        random one on first use. The key has to stay private (next to the
+        plain dataset), anyone who has it can check guessed names.
+    '''
+    if not os.path.exists(keyfile):
+        with open(keyfile, "w", encoding="ascii") as output:
+            output.write(secrets.token_hex(32))
+    with open(keyfile, encoding="ascii") as keyinput:
+        return Anonymizer(keyinput.read().strip())
+
+
+def chainTransforms(transforms, name):
+    ''' Returns a function applying the transforms, callables taking the
+        table name and a table and returning a table, in order.
+    '''
+    def apply(table):
+        for transform in transforms:
+            table = transform(name, table)
+        return table
+    return apply
+
+
+class ChunkWriter:
+    ''' Collects raw rows and every chunk_size rows converts them into a
+        table with build and appends it to a parquet file as one row group.
+        Every (writer, derive) pair in derived gets derive(rows, table) of
+        each chunk written as well. Every (path, transform) pair in mirrors
+        is another parquet file getting transform(table) of everything
+        written, so a chunk is parsed and built once for all the outputs.
+    '''
+
+    def __init__(self, path, schema, build, chunk_size=CHUNK_SIZE, derived=(), mirrors=()):
+        self.path = path
+        self.schema = schema
+        self.build = build
+        self.chunk_size = chunk_size
+        self.derived = derived
+        self.rows = []
+        self.count = 0
+        self.writer = pq.ParquetWriter(path, schema)
+        self.mirrors = [(pq.ParquetWriter(mirrorpath, schema), transform) for mirrorpath, transform in mirrors]
+
+    def write(self, table):
+        self.writer.write_table(table)
+        for writer, transform in self.mirrors:
+            writer.write_table(transform(table))
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def writeTable(self, table):
+        ''' Writes an already built chunk, keeping the order of pending rows. '''
+        self.flush()
+        self.write(table.cast(self.schema))
+        self.count += table.num_rows
+
+    def flush(self):
+        if self.rows:
+            table = self.build(self.rows)
+            self.write(table)
+            for writer, derive in self.derived:
+                writer.writeTable(derive(self.rows, table))
+            self.count += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        for writer, transform in self.mirrors:
+            writer.close()
+
+
+def openWriters(paths, chunk_size=CHUNK_SIZE, mirrors=()):
+    ''' Opens a writer for every table in paths. The reactions are fed
+        alongside the messages, the tokens and postings are derived from
+        the messages. mirrors are (paths, transforms) pairs of further
+        datasets written from the same tables through the transforms.
+    '''
+    def tableMirrors(name):
+        return [(mirrorpaths[name], chainTransforms(transforms, name)) for mirrorpaths, transforms in mirrors]
+
+    writers = {"reactions": ChunkWriter(paths["reactions"], REACTION_SCHEMA, buildReactions, chunk_size,
+                                        mirrors=tableMirrors("reactions")),
+               "tokens": ChunkWriter(paths["tokens"], TOKEN_SCHEMA, None, chunk_size,
+                                     mirrors=tableMirrors("tokens")),
+               "postings": ChunkWriter(paths["postings"], POSTING_SCHEMA, None, chunk_size,
+                                       mirrors=tableMirrors("postings"))}
+    writers["messages"] = ChunkWriter(paths["messages"], MESSAGE_SCHEMA, buildMessages, chunk_size,
+                                      derived=[(writers["tokens"], buildTokens),
+                                               (writers["postings"], buildPostings)],
+                                      mirrors=tableMirrors("messages"))
+    return writers
+
+
+def closeWriters(writers):
+    # the messages first, their last chunk still feeds the derived writers
+    writers["messages"].close()
+    for name, writer in writers.items():
+        if name != "messages":
+            writer.close()
+
+
+def readMessageFile(source, relpath):
+    ''' Returns the thread metadata of a message file of a source and an
+        iterator over its messages. With ijson the metadata is read in a
+        first pass (it is stored after the messages) and the messages are
+        parsed one by one in a second pass.
+    '''
+    if ijson is None:
+        with source.open(relpath) as jsonfile:
+            data = json.load(jsonfile)
+        info = {"participants": [participant["name"] for participant in data["participants"]],
+                "title": data["title"], "thread_type": data["thread_type"]}
+        return info, iter(data["messages"])
+
+    info = {"participants": [], "title": "", "thread_type": ""}
+    with source.open(relpath) as jsonfile:
+        for prefix, event, value in ijson.parse(jsonfile):
+            if prefix == "participants.item.name":
+                info["participants"].append(value)
+            elif prefix == "title" or prefix == "thread_type":
+                info[prefix] = value
+
+    def messages():
+        with source.open(relpath) as jsonfile:
+            yield from ijson.items(jsonfile, "messages.item")
+
+    return info, messages()
+
+
+def findOwner(info):
+    ''' In a private conversation the second participant is the inbox owner. '''
+    if info["thread_type"] == "Regular" and len(info["participants"]) > 1:
+        return fixEncoding(info["participants"][1])
+    return ""
+
+
+def flattenMessages(info, messages, message_id):
+    ''' Generates a (message row, reaction rows) pair for every Generic
+        message of a file, numbering the messages from message_id. The rows
+        keep the raw values from the json, the per-thread fields are decoded
+        once here and everything else in bulk by buildMessages/buildReactions.
+        Message rows end with the id of the first message of the file.
+    '''
+    first_id = message_id
+    numberofpeople = len(info["participants"])
+    threadtype = fixEncoding(info["thread_type"])
+    threadname = fixEncoding(info['title'])
+    for message in messages:
+        if (message["type"] == "Generic"):
+            author = message["sender_name"]
+            timestamp = message["timestamp_ms"]
+            reactions = []
+            react = message.get("reactions")
+            if react:
+                for reaction in react:
+                    reactions.append((message_id, threadtype, numberofpeople, threadname, author,
+                                      timestamp, reaction['reaction'], reaction['actor']))
+            content = message.get("content") or None
+            yield (message_id, threadtype, numberofpeople, threadname, author, timestamp, content,
+                   first_id), reactions
+            message_id+=1
+
+
+def hashFile(filepath):
+    ''' Returns the sha1 of a file's content. '''
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as datafile:
+        for block in iter(lambda: datafile.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class DirectorySource:
+    ''' The message files of an unpacked messages/inbox folder. '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self):
+        ''' Returns the paths (relative to the inbox) of all message files,
+            in the order in which they are ingested.
+        '''
+        files = []
+        for thread in sorted(os.listdir(self.root)):
+            for messagefile in sorted(os.listdir(os.path.join(self.root, thread))):
+                if (messagefile.endswith("json")):
+                    files.append(thread + "/" + messagefile)
+        return files
+
+    def stat(self, relpath):
+        ''' Returns the size and the modification time (ns) of a file. '''
+        stat = os.stat(os.path.join(self.root, relpath))
+        return stat.st_size, stat.st_mtime_ns
+
+    def hash(self, relpath):
+        return hashFile(os.path.join(self.root, relpath))
+
+    def open(self, relpath):
+        return open(os.path.join(self.root, relpath), "rb")
+
+
+class ZipSource:
+    ''' The message files inside the archives of a Facebook export (all the
+        parts of a multi-part one), read straight from the archives. Only
+        the messages/inbox/*/message_*.json members are ever decompressed,
+        photos, videos and everything else are skipped.
+        The CRC32 stored in the archive stands in for the hash of a file,
+        so finding the changed files costs no decompression either.
+        Picklable, every worker process gets it once (see initWorker) and
+        opens the archives on its own.
+    '''
+
+    MEMBER = re.compile(r"(?:^|/)messages/inbox/([^/]+)/(message_\d+\.json)$")
+
+    def __init__(self, archives):
+        self.archives = [os.path.abspath(archive) for archive in archives]
+        # relpath -> (archive number, member name, size, mtime, crc)
+        self.members = {}
+        for number, archive in enumerate(self.archives):
+            with zipfile.ZipFile(archive) as zipped:
+                for member in zipped.infolist():
+                    match = self.MEMBER.search(member.filename)
+                    if match is not None:
+                        mtime = int(time.mktime(member.date_time + (0, 0, -1))) * 10**9
+                        self.members.setdefault(match.group(1) + "/" + match.group(2),
+                                                (number, member.filename, member.file_size, mtime, member.CRC))
+        self.handles = {}
+        self.last = None
+
+    def __getstate__(self):
+        return {"archives": self.archives, "members": self.members, "handles": {}, "last": None}
+
+    def list(self):
+        ''' Returns the message files in the order in which they are
+            ingested, like DirectorySource.list, whichever part they are in.
+        '''
+        threads = {}
+        for relpath in self.members:
+            thread, messagefile = relpath.split("/")
+            threads.setdefault(thread, []).append(messagefile)
+        return [thread + "/" + messagefile for thread in sorted(threads) for messagefile in sorted(threads[thread])]
+
+    def stat(self, relpath):
+        number, name, size, mtime, crc = self.members[relpath]
+        return size, mtime
+
+    def hash(self, relpath):
+        return "crc32:{:08x}".format(self.members[relpath][4])
+
+    def open(self, relpath):
+        ''' Returns the content of a member as a file. The last member is
+            kept decompressed, readMessageFile reads it twice with ijson.
+        '''
+        if self.last is None or self.last[0] != relpath:
+            number, name, size, mtime, crc = self.members[relpath]
+            if number not in self.handles:
+                self.handles[number] = zipfile.ZipFile(self.archives[number])
+            self.last = (relpath, self.handles[number].read(name))
+        return io.BytesIO(self.last[1])
+
+
+def loadManifest(manifestfile):
+    ''' Returns the manifest of the previous run, or None if there is no usable one. '''
+    if not os.path.exists(manifestfile):
+        return None
+    with open(manifestfile, encoding="utf-8") as jsonfile:
+        manifest = json.load(jsonfile)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def saveManifest(manifestfile, manifest):
+    tmpfile = manifestfile + ".tmp"
+    with open(tmpfile, "w", encoding="utf-8") as jsonfile:
+        json.dump(manifest, jsonfile, ensure_ascii=False, indent=1)
+    os.replace(tmpfile, manifestfile)
+
+
+def removeFingerprint(directory):
+    ''' Deletes the fingerprint of a dataset that is about to be rewritten,
+        meanwhile plots.py falls back to the modification time of its tables.
+    '''
+    try:
+        os.remove(os.path.join(directory, "fingerprint.txt"))
+    except FileNotFoundError:
+        pass
+
+
+def writeFingerprint(directory):
+    ''' Writes a new random fingerprint of the dataset in a directory.
+        plots.py keys its figure cache with it, so figures of older data
+        are never shown.
+    '''
+    with open(os.path.join(directory, "fingerprint.txt"), "w", encoding="utf-8") as fingerprintfile:
+        fingerprintfile.write(secrets.token_hex(8))
+
+
+def planIngest(source, files, manifest):
+    ''' Compares the message files with the manifest of the previous run.
+        A file whose size and mtime did not change is trusted, otherwise its
+        hash decides. Returns the files that have to be parsed and the
+        manifest entries of the files that can be kept.
+    '''
+    toparse = []
+    unchanged = {}
+    for relpath in files:
+        size, mtime = source.stat(relpath)
+        entry = manifest["files"].get(relpath)
+        if entry is not None and entry["size"] == size:
+            if entry["mtime"] != mtime and entry["hash"] == source.hash(relpath):
+                entry = dict(entry, mtime=mtime)
+            if entry["mtime"] == mtime:
+                unchanged[relpath] = entry
+                continue
+        toparse.append(relpath)
+    return toparse, unchanged
+
+
+def writeFiles(source, relpaths, writers, first_id=1):
+    ''' Streams the given message files of a source into the writers, numbering the
+        messages from first_id. Returns the manifest entries of the files
+        and the owner name found in them ("" if it could not be determined).
+    '''
+    message_id = first_id
+    owner = ""
+    entries = {}
+    for relpath in relpaths:
+        size, mtime = source.stat(relpath)
+        entry = {"size": size, "mtime": mtime, "hash": source.hash(relpath),
+                 "first_id": message_id, "messages": 0, "reactions": 0}
+        info, messages = readMessageFile(source, relpath)
+        if owner == "":
+            owner = findOwner(info)
+        for row, reactions in flattenMessages(info, messages, message_id):
+            writers["messages"].append(row)
+            writers["reactions"].extend(reactions)
+            entry["reactions"] += len(reactions)
+            message_id += 1
+        entry["messages"] = message_id - entry["first_id"]
+        entries[relpath] = entry
+    return entries, owner
+
+
+def initWorker(source):
+    ''' Worker initializer: keeps the source for all tasks of the process,
+        so it is sent once and (a ZipSource) opens its archives once.
+    '''
+    global worker_source
+    worker_source = source
+
+
+def batchThreads(source, relpaths, count):
+    ''' Splits the files into about count batches of whole consecutive
+        threads of similar total size, the tasks of the worker processes.
+    '''
+    sizes = [source.stat(relpath)[0] for relpath in relpaths]
+    target = sum(sizes) / count
+    batches = []
+    batch = []
+    size = 0
+    for thread, group in itertools.groupby(zip(relpaths, sizes), key=lambda item: item[0].split("/")[0]):
+        for relpath, filesize in group:
+            batch.append(relpath)
+            size += filesize
+        if size >= target:
+            batches.append(batch)
+            batch = []
+            size = 0
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def writeFilesPart(relpaths, partdir, index, chunk_size=CHUNK_SIZE):
+    ''' Worker entry point: writes the files of a batch of threads of the
+        source of the process into their own part files, with message ids
+        numbered from 1.
+    '''
+    parts = {name: os.path.join(partdir, "{}_{}.parquet".format(name, index)) for name in TABLE_SCHEMAS}
+    writers = openWriters(parts, chunk_size)
+    entries, owner = writeFiles(worker_source, relpaths, writers)
+    closeWriters(writers)
+    return entries, owner, parts
+
+
+def appendPart(partpath, writer, offset, chunk_size=CHUNK_SIZE):
+    ''' Copies a part file into the final output, shifting the message ids. '''
+    for batch in pq.ParquetFile(partpath).iter_batches(batch_size=chunk_size):
+        table = pa.Table.from_batches([batch])
+        table = table.set_column(0, "id", pc.add(table.column("id"), offset))
+        writer.writeTable(table)
+    os.remove(partpath)
+
+
+def copyKeptRows(path, writer, dropped, chunk_size=CHUNK_SIZE):
+    ''' Copies the rows of the previous output, leaving out the ids that
+        fall into one of the dropped [first, last) ranges.
+    '''
+    dropped = sorted(dropped)
+    starts = np.array([first for first, last in dropped], dtype="int64")
+    ends = np.array([last for first, last in dropped], dtype="int64")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        table = pa.Table.from_batches([batch])
+        if len(dropped) > 0:
+            ids = table.column("id").to_numpy()
+            index = np.searchsorted(starts, ids, side="right") - 1
+            mask = (index >= 0) & (ids < ends[np.maximum(index, 0)])
+            table = table.filter(pa.array(~mask))
+        writer.writeTable(table)
+
+
+def exportCsv(parquetfile, csvfile, chunk_size=CHUNK_SIZE):
+    ''' Writes a table in the old csv layout, with an iso formatted date
+        column in place of the timestamp.
+    '''
+    header = True
+    for batch in pq.ParquetFile(parquetfile).iter_batches(batch_size=chunk_size):
+        frame = batch.to_pandas()
+        date = pd.to_datetime(frame[["year", "month", "day", "hour", "minute", "second"]])
+        frame.insert(frame.columns.get_loc("timestamp"), "date", date.dt.strftime("%Y-%m-%dT%H:%M:%S"))
+        frame = frame.drop(columns="timestamp")
+        frame.to_csv(csvfile, mode="w" if header else "a", header=header, index=False)
+        header = False
+    if header:
+        columns = [name if name != "timestamp" else "date" for name in pq.read_schema(parquetfile).names]
+        pd.DataFrame(columns=columns).to_csv(csvfile, index=False)
+
+
+def ingest(source, paths, manifestfile, workers=1, chunk_size=CHUNK_SIZE, full=False, indexfile=None, mirrors=()):
+    ''' Streams the inbox into the parquet files of the messages, reactions
+        and tokens tables given in paths, holding at most chunk_size rows of
+        each in memory. source is a DirectorySource or a ZipSource, or the
+        path of an unpacked inbox.
+
+        The manifest records every ingested file with the id range of its
+        messages. Unless full is set, only new or changed files are parsed:
+        the rows of changed and deleted files are dropped from the previous
+        output and the new rows are appended with fresh ids.
+
+        With more than one worker batches of consecutive threads are written
+        to their own part files by a pool of processes and the parts are
+        merged in sorted thread order, so the message ids and the owner do not
+        depend on the number of workers.
+        With an indexfile, the search index is rebuilt from the postings
+        whenever they change (or the index is missing). Every directory
+        written to gets a new fingerprint.txt once all of its files are.
+
+        mirrors are (paths, transforms, indexfile) triples of further
+        datasets, e.g. an anonymized one, written from the same parse: every
+        table written to paths is also passed through the transforms (see
+        chainTransforms) and written to the paths of the mirror. A mirror is
+        rewritten whole from the kept and new rows, unless it was written by
+        the previous run and nothing changed.
+        Returns the number of parsed messages and the manifest.
+    '''
+    if isinstance(source, str):
+        source = DirectorySource(source)
+    files = source.list()
+    manifest = None
+    if not full and all(os.path.exists(path) for path in paths.values()):
+        manifest = loadManifest(manifestfile)
+    if manifest is None:
+        manifest = {"version": MANIFEST_VERSION, "owner": "", "next_id": 1, "files": {}}
+
+    toparse, unchanged = planIngest(source, files, manifest)
+    dropped = [(entry["first_id"], entry["first_id"] + entry["messages"])
+               for relpath, entry in manifest["files"].items() if relpath not in unchanged]
+    mirrored = [os.path.abspath(mirrorpaths["messages"]) for mirrorpaths, transforms, mirrorindex in mirrors]
+    current = all(path in manifest.get("mirrors", []) for path in mirrored) and \
+        all(os.path.exists(path) for mirrorpaths, transforms, mirrorindex in mirrors for path in mirrorpaths.values())
+    directories = [os.path.dirname(os.path.abspath(tablepaths["messages"]))
+                   for tablepaths in [paths] + [mirrorpaths for mirrorpaths, transforms, mirrorindex in mirrors]]
+    if len(toparse) == 0 and len(dropped) == 0 and current:
+        manifest["files"] = unchanged
+        saveManifest(manifestfile, manifest)
+        for postingsfile, index in [(paths["postings"], indexfile)] + \
+                [(mirrorpaths["postings"], mirrorindex) for mirrorpaths, transforms, mirrorindex in mirrors]:
+            if index is not None and not os.path.exists(index):
+                buildSearchIndex(postingsfile, index, chunk_size)
+        for directory in directories:
+            if not os.path.exists(os.path.join(directory, "fingerprint.txt")):
+                writeFingerprint(directory)
+        return 0, manifest
+
+    writers = openWriters({name: path + ".tmp" for name, path in paths.items()}, chunk_size,
+                          [({name: path + ".tmp" for name, path in mirrorpaths.items()}, transforms)
+                           for mirrorpaths, transforms, mirrorindex in mirrors])
+    if len(unchanged) > 0:
+        for name, path in paths.items():
+            copyKeptRows(path, writers[name], dropped, chunk_size)
+
+    owner = manifest["owner"]
+    next_id = manifest["next_id"]
+    entries = {}
+    if workers > 1:
+        batches = batchThreads(source, toparse, workers * BATCHES_PER_WORKER)
+        outdir = os.path.dirname(os.path.abspath(paths["messages"]))
+        with tempfile.TemporaryDirectory(dir=outdir) as partdir, \
+                ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(source,)) as pool:
+            results = pool.map(writeFilesPart, batches, [partdir] * len(batches),
+                               range(len(batches)), [chunk_size] * len(batches))
+            for threadentries, threadowner, parts in results:
+                for name, partpath in parts.items():
+                    appendPart(partpath, writers[name], next_id - 1, chunk_size)
+                for relpath, entry in threadentries.items():
+                    entry["first_id"] += next_id - 1
+                    entries[relpath] = entry
+                next_id += sum(entry["messages"] for entry in threadentries.values())
+                if owner == "":
+                    owner = threadowner
+    else:
+        entries, threadowner = writeFiles(source, toparse, writers, next_id)
+        next_id += sum(entry["messages"] for entry in entries.values())
+        if owner == "":
+            owner = threadowner
+
+    closeWriters(writers)
+    for directory in directories:
+        removeFingerprint(directory)
+    for path in list(paths.values()) + [path for mirrorpaths, transforms, mirrorindex in mirrors
+                                        for path in mirrorpaths.values()]:
+        os.replace(path + ".tmp", path)
+
+    unchanged.update(entries)
+    manifest["files"] = {relpath: unchanged[relpath] for relpath in files}
+    manifest["owner"] = owner
+    manifest["next_id"] = next_id
+    manifest["mirrors"] = mirrored
+    saveManifest(manifestfile, manifest)
+    if indexfile is not None:
+        buildSearchIndex(paths["postings"], indexfile, chunk_size)
+    for mirrorpaths, transforms, mirrorindex in mirrors:
+        if mirrorindex is not None:
+            buildSearchIndex(mirrorpaths["postings"], mirrorindex, chunk_size)
+    for directory in directories:
+        writeFingerprint(directory)
+    return sum(entry["messages"] for entry in entries.values()), manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts the Messenger inbox into messages.parquet, "
+                                                 "reactions.parquet, tokens.parquet, postings.parquet "
+                                                 "and the search index search_index.arrow")
+    parser.add_argument("archives", nargs="*",
+                        help="the .zip files of the export (all parts of it), read without unpacking; "
+                             "without them the unpacked messages/inbox folder next to this script is read")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing (and decompressing) the threads in parallel "
+                             "(default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of rows buffered before writing (default: {})".format(CHUNK_SIZE))
+    parser.add_argument("--full", action="store_true",
+                        help="ignore manifest.json and parse the whole inbox again")
+    parser.add_argument("--csv", action="store_true",
+                        help="additionally export messages.csv and reactions.csv")
+    parser.add_argument("--anonymized", metavar="DIRECTORY",
+                        help="also write a copy of the dataset with pseudonyms in place of the names "
+                             "of people and conversations to DIRECTORY, from the same parse")
+    args = parser.parse_args()
+
+    basefile = os.path.dirname(os.path.abspath(__file__))
+    if args.archives:
+        source = ZipSource(args.archives)
+    else:
+        source = DirectorySource(os.path.join(basefile, "messages", "inbox"))
+    paths = {name: os.path.join(basefile, name + ".parquet") for name in TABLE_SCHEMAS}
+    manifestfile = os.path.join(basefile, "manifest.json")
+    mirrors = []
+    if args.anonymized:
+        os.makedirs(args.anonymized, exist_ok=True)
+        anonymizer = loadAnonymizer(os.path.join(basefile, "anonymization.key"))
+        mirrors.append(({name: os.path.join(args.anonymized, name + ".parquet") for name in TABLE_SCHEMAS},
+                        [anonymizer], os.path.join(args.anonymized, "search_index.arrow")))
+
+    count, manifest = ingest(source, paths, manifestfile, workers=args.workers, chunk_size=args.chunk_size,
+                             full=args.full, indexfile=os.path.join(basefile, "search_index.arrow"),
+                             mirrors=mirrors)
+
+    # the owner name of every output directory
+    owners = {basefile: manifest["owner"]}
+    if args.anonymized:
+        owners[args.anonymized] = anonymizer.pseudonym(manifest["owner"]) if manifest["owner"] else ""
+    for directory, owner in owners.items():
+        owfilepath = os.path.join(directory, "owner.txt")
+        with open(owfilepath , "w", encoding="utf-8") as ownerfile:
+            ownerfile.write(owner)
+
+        if args.csv:
+            exportCsv(os.path.join(directory, "messages.parquet"), os.path.join(directory, "messages.csv"),
+                      args.chunk_size)
+            exportCsv(os.path.join(directory, "reactions.parquet"), os.path.join(directory, "reactions.csv"),
+                      args.chunk_size)
+
+    total = sum(entry["messages"] for entry in manifest["files"].values())
+    print(str(count) + " nowych wiadomości, razem " + str(total) + " wiadomości")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import json
+import random
+import itertools
+import argparse
+import unicodedata
+
+# Writes a made-up messages/inbox tree in the layout of the Facebook export,
+# so generate.py and plots.py can be measured without sharing a real inbox.
+
+FIRST_NAMES = ["Mikołaj", "Katarzyna", "Mateusz", "Zofia", "Łukasz", "Małgorzata", "Paweł", "Agnieszka",
+               "Michał", "Joanna", "Jędrzej", "Żaneta", "Bartłomiej", "Aleksandra", "Grzegorz", "Anna"]
+LAST_NAMES = ["Nowak", "Kowalski", "Wiśniewska", "Wójcik", "Kowalczyk", "Kamiński", "Lewandowska", "Zieliński",
+              "Szymańska", "Woźniak", "Dąbrowski", "Kozłowska", "Jankowski", "Mazur", "Krawczyk", "Żółkiewski"]
+SYLLABLES = ["ka", "ma", "la", "sz", "cz", "rz", "ą", "ę", "ó", "ł", "ż", "ść", "nie", "po", "dzi", "wa",
+             "to", "je", "go", "mi", "ra", "no", "ko", "by", "ci", "się", "że", "ja"]
+EMOJIS = ["❤", "😆", "😮", "😢", "😠", "👍", "👎", "😍"]
+OTHER_TYPES = ["Share", "Call", "Subscribe", "Unsubscribe"]
+
+# the export splits long conversations into files of this many messages
+MESSAGES_PER_FILE = 10000
+
+
+def mojibake(text):
+    ''' Encodes a string the way the export does: the utf-8 bytes read as latin-1. '''
+    return text.encode("utf-8").decode("latin-1")
+
+
+def makeVocabulary(rng, size):
+    ''' Returns made-up words with Polish diacritics, the common ones first. '''
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def makePeople(rng, count):
+    people = []
+    seen = set()
+    while len(people) < count:
+        name = rng.choice(FIRST_NAMES) + " " + rng.choice(LAST_NAMES)
+        if name in seen:
+            name += " " + str(len(people))
+        seen.add(name)
+        people.append(name)
+    return people
+
+
+def splitMessages(rng, total, threads):
+    ''' Splits the messages between the threads with a long tail, like a
+        real inbox: a few conversations hold most of the messages.
+    '''
+    weights = [1 / (rank + 1) for rank in range(threads)]
+    rng.shuffle(weights)
+    scale = total / sum(weights)
+    counts = [max(1, int(weight * scale)) for weight in weights]
+    counts[0] += total - sum(counts)
+    return counts
+
+
+def makeMessage(rng, sender, timestamp, members, vocabulary, cumweights, args):
+    message = {"sender_name": mojibake(sender), "timestamp_ms": timestamp}
+    if rng.random() < args.other_share:
+        message["type"] = rng.choice(OTHER_TYPES)
+        return message
+    message["type"] = "Generic"
+    if rng.random() < args.text_share:
+        length = max(1, int(rng.expovariate(1 / args.words)))
+        message["content"] = mojibake(" ".join(rng.choices(vocabulary, cum_weights=cumweights, k=length)))
+    else:
+        message["photos"] = [{"uri": "messages/inbox/photos/" + str(timestamp) + ".jpg",
+                              "creation_timestamp": timestamp // 1000}]
+    if rng.random() < args.reactions:
+        actors = rng.sample(members, rng.randint(1, min(3, len(members))))
+        message["reactions"] = [{"reaction": mojibake(rng.choice(EMOJIS)), "actor": mojibake(actor)}
+                                for actor in actors]
+    return message
+
+
+def writeThread(root, index, title, members, threadtype, count, rng, vocabulary, cumweights, args):
+    ''' Writes one conversation as message_1.json, message_2.json, ... with
+        the newest messages in the first file, newest first, as the export does.
+    '''
+    ascii = unicodedata.normalize("NFKD", title.replace("ł", "l").replace("Ł", "L")).encode("ascii", "ignore")
+    directory = ascii.decode("ascii").lower().replace(" ", "") + "_" + str(1000000 + index)
+    path = os.path.join(root, directory)
+    os.makedirs(path, exist_ok=True)
+    end = args.end * 1000
+    start = end - int(args.years * 365.25 * 86400 * 1000)
+    timestamps = sorted((rng.randint(start, end) for _ in range(count)), reverse=True)
+    participants = [{"name": mojibake(member)} for member in members]
+    files = (count + args.messages_per_file - 1) // args.messages_per_file
+    for number in range(files):
+        messages = [makeMessage(rng, rng.choice(members), timestamp, members, vocabulary, cumweights, args)
+                    for timestamp in timestamps[number * args.messages_per_file:(number + 1) * args.messages_per_file]]
+        data = {"participants": participants, "messages": messages, "title": mojibake(title),
+                "is_still_participant": True, "thread_type": threadtype,
+                "thread_path": "inbox/" + directory}
+        with open(os.path.join(path, "message_" + str(number + 1) + ".json"), "w") as jsonfile:
+            json.dump(data, jsonfile, indent=2)
+    if args.media:
+        os.makedirs(os.path.join(path, "photos"), exist_ok=True)
+
+
+def generateExport(directory, args):
+    ''' Writes directory/messages/inbox and returns the number of messages. '''
+    rng = random.Random(args.seed)
+    root = os.path.join(directory, "messages", "inbox")
+    vocabulary = makeVocabulary(rng, args.vocabulary)
+    # Zipf-like word frequencies
+    cumweights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    people = makePeople(rng, args.threads + 1)
+    owner, friends = people[0], people[1:]
+    groups = int(args.threads * args.group_share)
+    counts = splitMessages(rng, args.messages, args.threads)
+    for index, count in enumerate(counts):
+        if index < groups:
+            members = rng.sample(friends, min(len(friends), rng.randint(2, 8))) + [owner]
+            title = "Grupa " + str(index + 1)
+            threadtype = "RegularGroup"
+        else:
+            # in a private conversation the owner is the second participant
+            members = [friends[index], owner]
+            title = friends[index]
+            threadtype = "Regular"
+        writeThread(root, index, title, members, threadtype, count, rng, vocabulary, cumweights, args)
+    return sum(counts)
+
+
+def addArguments(parser):
+    parser.add_argument("--messages", type=int, default=10000, help="total number of messages (default: 10000)")
+    parser.add_argument("--threads", type=int, default=50, help="number of conversations (default: 50)")
+    parser.add_argument("--group-share", type=float, default=0.2,
+                        help="fraction of the conversations that are groups (default: 0.2)")
+    parser.add_argument("--words", type=float, default=8,
+                        help="mean number of words of a text message (default: 8)")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="number of distinct words (default: 5000)")
+    parser.add_argument("--text-share", type=float, default=0.9,
+                        help="fraction of the Generic messages with text, the rest are photos (default: 0.9)")
+    parser.add_argument("--other-share", type=float, default=0.05,
+                        help="fraction of non-Generic messages, e.g. calls and shares (default: 0.05)")
+    parser.add_argument("--reactions", type=float, default=0.1,
+                        help="fraction of the messages with reactions (default: 0.1)")
+    parser.add_argument("--years", type=float, default=5, help="time span of the messages (default: 5)")
+    parser.add_argument("--end", type=int, default=1600000000,
+                        help="unix time of the newest message (default: 1600000000)")
+    parser.add_argument("--messages-per-file", type=int, default=MESSAGES_PER_FILE,
+                        help="messages per message_N.json file (default: {})".format(MESSAGES_PER_FILE))
+    parser.add_argument("--media", action="store_true", help="also create empty photos folders")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic Messenger export (messages/inbox) "
+                                                 "for testing and benchmarking generate.py and plots.py")
+    parser.add_argument("directory", help="where to create the messages folder")
+    addArguments(parser)
+    args = parser.parse_args()
+    count = generateExport(args.directory, args)
+    print(str(count) + " wiadomości zapisane w " + os.path.join(args.directory, "messages", "inbox"))
+
+
+if __name__ == "__main__":
+    main()
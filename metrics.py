@@ -0,0 +1,154 @@
+import time
+import json
+import functools
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+import numpy as np
+
+# Timing of the Dash callbacks. A record is started for every
+# /_dash-update-component request; the callbacks add the time of their phases
+# (phase) and their cache hits (increment) to it, and when the response is sent
+# the record is added to the statistics of the callback (by its outputs).
+# Requests that fail are only counted, as errors of the callback.
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# number of latest requests of a callback the percentiles are computed from
+SAMPLES = 1000
+
+current = contextvars.ContextVar("metrics_record", default=None)
+
+
+@contextmanager
+def phase(name):
+    ''' Adds the time spent in the block to a phase of the current request. '''
+    record = current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record["phases"][name] = record["phases"].get(name, 0.0) + time.perf_counter() - start
+
+
+def increment(name, value=1):
+    ''' Adds to a counter (e.g. cache hits) of the current request. '''
+    record = current.get()
+    if record is not None:
+        record["counters"][name] += value
+
+
+def instrumented(function):
+    ''' Wraps a callback so its whole run is timed as the "callback" phase;
+        what the request takes on top of it is Dash serializing the output.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with phase("callback"):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    return {"p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+class CallbackMetrics:
+    ''' The timings of the latest requests of every callback. With a
+        logfile, every request is also appended to it as a json line.
+    '''
+
+    def __init__(self, logfile=None):
+        self.series = {}
+        self.logfile = logfile
+        self.lock = threading.Lock()
+
+    def start(self, name):
+        current.set({"callback": name, "phases": {}, "counters": Counter(), "start": time.perf_counter()})
+
+    def finish(self, size, failed=False):
+        record = current.get()
+        if record is None:
+            return
+        current.set(None)
+        phases = record["phases"]
+        phases["total"] = time.perf_counter() - record["start"]
+        if "callback" in phases:
+            phases["serialize"] = phases["total"] - phases["callback"]
+        with self.lock:
+            series = self.series.setdefault(record["callback"], {
+                "requests": 0, "errors": 0, "phases": {}, "bytes": deque(maxlen=SAMPLES), "counters": Counter(),
+                "histogram": [0] * (len(BUCKETS_MS) + 1)})
+            if failed:
+                series["errors"] += 1
+                if self.logfile:
+                    with open(self.logfile, "a", encoding="utf-8") as logfile:
+                        logfile.write(json.dumps({"time": time.time(), "callback": record["callback"],
+                                                  "error": True, "ms": {"total": phases["total"] * 1000}}) + "\n")
+                return
+            series["requests"] += 1
+            for name, seconds in phases.items():
+                series["phases"].setdefault(name, deque(maxlen=SAMPLES)).append(seconds * 1000)
+            series["bytes"].append(size)
+            series["counters"].update(record["counters"])
+            series["histogram"][np.searchsorted(BUCKETS_MS, phases["total"] * 1000)] += 1
+            if self.logfile:
+                with open(self.logfile, "a", encoding="utf-8") as logfile:
+                    logfile.write(json.dumps({"time": time.time(), "callback": record["callback"],
+                                              "ms": {name: seconds * 1000 for name, seconds in phases.items()},
+                                              "bytes": size, "counters": record["counters"]}) + "\n")
+
+    def summary(self):
+        ''' Percentiles of the phases (ms) and response sizes (bytes) of every
+            callback, the cumulative counters and a histogram of the total
+            request time: requests up to each bucket bound, as in Prometheus.
+            Failed requests are only counted, in errors.
+        '''
+        with self.lock:
+            result = {}
+            for name, series in self.series.items():
+                cumulative = np.cumsum(series["histogram"]).tolist()
+                result[name] = {
+                    "requests": series["requests"],
+                    "errors": series["errors"],
+                    "ms": {phasename: percentiles(values) for phasename, values in series["phases"].items()},
+                    "bytes": percentiles(series["bytes"]) if series["bytes"] else {},
+                    "counters": dict(series["counters"]),
+                    "histogram_ms": dict(zip([str(bound) for bound in BUCKETS_MS] + ["+Inf"], cumulative))}
+            return result
+
+    def install(self, server, path="/metrics"):
+        ''' Times the callback requests of a Dash app's Flask server and
+            serves the summary on path. Flask skips after_request when a
+            callback raises, so such a record is finished as failed on
+            teardown, and every request starts without one: a thread (e.g.
+            of a gunicorn worker) serves many requests.
+        '''
+        from flask import request
+
+        @server.before_request
+        def startRecord():
+            current.set(None)
+            if request.path.endswith("/_dash-update-component"):
+                body = request.get_json(silent=True) or {}
+                self.start(body.get("output", "?"))
+
+        @server.after_request
+        def finishRecord(response):
+            if current.get() is not None:
+                self.finish(response.calculate_content_length() or 0, failed=response.status_code >= 500)
+            return response
+
+        @server.teardown_request
+        def failRecord(exception):
+            if current.get() is not None:
+                self.finish(0, failed=True)
+
+        @server.route(path)
+        def metricsSummary():
+            return server.response_class(json.dumps(self.summary()), mimetype="application/json")
@@ -1,16 +1,34 @@
 import dash
 import os
+import json
+import ctypes
+import shutil
+import hashlib
+import inspect
+import argparse
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode, parse_qs
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash import callback, clientside_callback
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from wordcloud import WordCloud
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 import time
 from dateutil.relativedelta import relativedelta
-import matplotlib.colors as mcolors
+from tokens import normalizePlurals, tokenizePositions
+from generate import localOffsets
+from cache import LRUCache, DiskCache
+from wordclouds import renderWordcloud, pngToUri, uriToPng
+from metrics import CallbackMetrics, phase, increment, instrumented
 
 # HELPER FUNCTIONS
 
@@ -25,6 +43,329 @@ def unixToDatetime(unix):
     return pd.to_datetime(unix, unit='s')
 
 
+def timestampsToDates(timestamps):
+    ''' Convert a column of unix timestamps to local naive datetimes. The
+        utc offsets are looked up once per distinct quarter of an hour (see
+        generate.localOffsets), pandas would convert the time zone of every
+        row in python.
+    '''
+    values = timestamps.to_numpy().astype("int64")
+    local = (values + localOffsets(values)).astype("datetime64[s]").astype("datetime64[ns]")
+    return pd.Series(local, index=timestamps.index, name=timestamps.name)
+
+
+def loadTable(path, columns, threads=False):
+    ''' Reads only the given columns of a parquet table, memory mapping the file,
+        and sorts the rows by timestamp so they can be sliced with timeSlice,
+        or with threads by thread and then timestamp for threadSlice.
+    '''
+    table = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return table.sort_values(["thread_name", "timestamp"] if threads else "timestamp",
+                             kind="stable", ignore_index=True)
+
+
+def narrowIntegers(table, columns):
+    ''' Stores integer columns in the smallest type that holds their values. '''
+    for column in columns:
+        table[column] = pd.to_numeric(table[column], downcast="integer")
+    return table
+
+
+def rangeBounds(timestamps, range):
+    ''' Returns the positions [start, end) of the sorted timestamps that
+        fall into the slider range, found by binary search.
+    '''
+    start = np.searchsorted(timestamps, range[0], side="left")
+    end = np.searchsorted(timestamps, range[1], side="right")
+    return start, end
+
+
+def timeSlice(table, range):
+    ''' Returns the rows of a timestamp sorted table that fall into the
+        slider range, as a slice of the table, not a filtered copy.
+    '''
+    start, end = rangeBounds(table["timestamp"].to_numpy(), range)
+    return table.iloc[start:end]
+
+
+def hourRange(range):
+    ''' Returns the slider range for slicing a cube (see buildCube). The
+        hours of a cube are stored by the timestamp of their start, so the
+        range is moved back to the start of the hour its beginning falls
+        in, to keep all messages of that first hour: any hour starting less
+        than an hour before it.
+    '''
+    return [range[0] - 3599, range[1]]
+
+
+def buildThreadIndex(table):
+    ''' Maps every thread of a table sorted by thread and timestamp to the
+        [start, end) positions of its rows, so that the rows of one thread
+        are found without scanning (or copying) the whole table.
+    '''
+    codes = table["thread_name"].cat.codes.to_numpy()
+    bounds = np.searchsorted(codes, np.arange(len(table["thread_name"].cat.categories) + 1))
+    index = {}
+    for code, thread in enumerate(table["thread_name"].cat.categories):
+        if bounds[code] < bounds[code + 1]:
+            index[thread] = (int(bounds[code]), int(bounds[code + 1]))
+    return index
+
+
+def threadSlice(table, index, thread, range=None):
+    ''' Returns the rows of a single thread that fall into the slider range
+        (all of them without a range), as a slice of the table, touching
+        only the timestamps of that thread.
+    '''
+    if thread not in index:
+        return table.iloc[0:0]
+    start, end = index[thread]
+    if range is not None:
+        first, last = rangeBounds(table["timestamp"].to_numpy()[start:end], range)
+        start, end = start + first, start + last
+    return table.iloc[start:end]
+
+
+def buildCube(table, keys, threads=False):
+    ''' Counts the rows of a table per local hour and the given key columns.
+        Each hour is stored as the timestamp of its start, so a cube is
+        sorted and sliced with timeSlice (or, with threads, threadSlice)
+        like the raw table, at the precision of one hour (see hourRange). The histograms are
+        built from these counts, so their size depends on the number of
+        bars, not messages.
+    '''
+    dates = timestampsToDates(table["timestamp"])
+    cube = pd.DataFrame({"timestamp": table["timestamp"] - dates.dt.minute * 60 - dates.dt.second,
+                         "day": dates.dt.normalize(), "hour": dates.dt.hour.astype("int8")})
+    for key in keys:
+        cube[key] = table[key]
+    cube = cube.groupby(["timestamp", "day", "hour"] + keys, observed=True).size()
+    cube = narrowIntegers(cube.reset_index(name="count"), ["count"])
+    if threads:
+        cube = cube.sort_values(["thread_name", "timestamp"], kind="stable", ignore_index=True)
+    return cube
+
+
+# the resolutions of the "over time" histograms with their (approximate)
+# length in seconds: the finest one showing the messages of the range in at
+# most TIME_BARS bars is used
+TIME_RESOLUTIONS = [("hour", 3600), ("day", 86400), ("week", 7 * 86400), ("month", 30.44 * 86400)]
+TIME_BARS = 150
+HOVER_FORMATS = {"hour": "%d %B %Y, %H:00", "day": "%A, %d %B %Y", "week": "week of %d %B %Y", "month": "%B %Y"}
+
+
+def timeResolution(span):
+    ''' Returns the finest resolution showing span seconds in at most TIME_BARS bars. '''
+    for resolution, seconds in TIME_RESOLUTIONS:
+        if span <= seconds * TIME_BARS:
+            return resolution
+    return TIME_RESOLUTIONS[-1][0]
+
+
+def bucketStarts(cube, resolution):
+    ''' Returns the local start of the bucket of every row of an hourly
+        cube, as naive datetimes; weeks start on Monday.
+    '''
+    day = cube["day"]
+    if resolution == "hour":
+        return day + pd.to_timedelta(cube["hour"].astype("int64"), unit="h")
+    if resolution == "day":
+        return day
+    if resolution == "week":
+        return day - pd.to_timedelta(day.dt.weekday, unit="D")
+    return day - pd.to_timedelta(day.dt.day - 1, unit="D")
+
+
+def buildTimeBuckets(cube, series, threads=False):
+    ''' Sums an hourly cube per series and day, week and month. Every bucket
+        keeps the first and the last hour with messages in it ("timestamp"
+        and "last"), so the rows are sorted like the cube (by thread first
+        with threads) and the buckets lying wholly in a range are found by
+        binary search (see timeBuckets).
+    '''
+    keys = ["thread_name"] if threads else []
+    buckets = {}
+    for resolution, seconds in TIME_RESOLUTIONS[1:]:
+        table = cube[keys + ["timestamp", series, "count"]].assign(bucket=bucketStarts(cube, resolution))
+        bounds = table.groupby(keys + ["bucket"], observed=True)["timestamp"].agg(["min", "max"])
+        counts = table.groupby(keys + ["bucket", series], observed=True)["count"].sum().reset_index()
+        counts = counts.join(bounds.rename(columns={"min": "timestamp", "max": "last"}), on=keys + ["bucket"])
+        counts = counts.sort_values(keys + ["timestamp", series], kind="stable", ignore_index=True)
+        buckets[resolution] = narrowIntegers(counts, ["count"])
+    return buckets
+
+
+def buildBucketBounds(cube):
+    ''' Returns for every resolution the first hour with messages of every
+        bucket of an hourly cube, sorted, and the local start of the bucket.
+        Any message of the cube (e.g. a search hit) falls into the last
+        bucket whose first hour is not after it, found by binary search.
+    '''
+    hours = cube.drop_duplicates("timestamp")
+    bounds = {}
+    for resolution, seconds in TIME_RESOLUTIONS:
+        starts = bucketStarts(hours, resolution)
+        first = (starts != starts.shift()).to_numpy()
+        bounds[resolution] = (hours["timestamp"].to_numpy()[first], starts.to_numpy()[first])
+    return bounds
+
+
+def timeBuckets(cube_slice, buckets, series):
+    ''' Returns the message counts of a slice of an hourly cube per bucket
+        (its local start) and series, at the resolution picked for the span
+        of the slice, and the resolution. The buckets lying wholly in the
+        slice are taken from the pre-aggregates of buildTimeBuckets (of the
+        same rows, e.g. one thread) and only the hours of the partial
+        buckets at its ends are summed, so the work depends on the number
+        of bars, not on the length of the range.
+    '''
+    timestamps = cube_slice["timestamp"].to_numpy()
+    resolution = timeResolution(int(timestamps[-1]) - int(timestamps[0]) + 3600)
+    parts = []
+    edges = cube_slice
+    if resolution != "hour":
+        table = buckets[resolution]
+        start = np.searchsorted(table["timestamp"].to_numpy(), timestamps[0], side="left")
+        end = np.searchsorted(table["last"].to_numpy(), timestamps[-1], side="right")
+        if start < end:
+            parts.append(table.iloc[start:end][["bucket", series, "count"]])
+            low = np.searchsorted(timestamps, table["timestamp"].iat[start], side="left")
+            high = np.searchsorted(timestamps, table["last"].iat[end - 1], side="right")
+            edges = pd.concat([cube_slice.iloc[:low], cube_slice.iloc[high:]])
+    parts.append(edges[[series, "count"]].assign(bucket=bucketStarts(edges, resolution)))
+    return countBy(pd.concat(parts), ["bucket", series]), resolution
+
+
+def prefixSum(values):
+    ''' Cumulative sum with a leading zero, as int32 when the total fits. '''
+    sums = np.concatenate([[0], np.cumsum(values, dtype=np.int64)])
+    return sums.astype(np.int32) if sums[-1] < 2**31 else sums
+
+
+def buildPrefixSums(table, sent):
+    ''' Cumulative sums of the number of messages, words and characters,
+        sent and received, over the rows of a timestamp sorted table (with
+        a leading zero). The totals of the rows [start, end) are then
+        prefix[key][end] - prefix[key][start], whatever the size of the range.
+        Works for any sorted table, e.g. the rows of one thread.
+    '''
+    prefix = {}
+    for who, mask in (("Sent", sent), ("Received", ~sent)):
+        prefix[(who, "count")] = prefixSum(mask)
+        for column in ("words", "chars"):
+            prefix[(who, column)] = prefixSum(np.where(mask, table[column].to_numpy(), 0))
+    return prefix
+
+
+def rangeSums(prefix, start, end):
+    ''' Returns the totals of the rows [start, end) from buildPrefixSums. '''
+    return {key: int(sums[end] - sums[start]) for key, sums in prefix.items()}
+
+
+def threadBuckets(data, thread):
+    ''' Returns the pre-aggregates of buildTimeBuckets of a single thread. '''
+    return {resolution: threadSlice(table, data.thread_buckets_threads[resolution], thread)
+            for resolution, table in data.thread_buckets.items()}
+
+
+def countBy(cube, keys):
+    ''' Sums the counts of a cube slice over everything but the keys. '''
+    return cube.groupby(keys, observed=True, as_index=False)["count"].sum()
+
+
+def compactCube(cube, series):
+    ''' Returns the rows of a cube as plain lists for the browser, with the
+        days and the series (the column the bars are coloured by) replaced
+        by indices into lists of their distinct values. The clientside
+        callbacks in assets/clientside.js sum these for any range.
+    '''
+    days, dayNames = pd.factorize(cube["day"].dt.strftime("%Y-%m-%d"))
+    codes, names = pd.factorize(cube[series].astype(str))
+    return {"timestamp": cube["timestamp"].tolist(), "hour": cube["hour"].tolist(),
+            "day": days.tolist(), "days": list(dayNames),
+            "series": codes.tolist(), "names": list(names), "count": cube["count"].tolist()}
+
+
+def loadSearchIndex(path):
+    ''' Memory maps the search index written by generate.py, None if there
+        is none. Only the list of words is read, the postings are paged in
+        when a query touches them (and shared between server workers). The
+        record batches of the file share the dictionaries, so the codes of
+        the words run on from one batch to the next.
+    '''
+    if not os.path.exists(path):
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    if reader.num_record_batches == 0:
+        return None
+    batches = []
+    for number in range(reader.num_record_batches):
+        batch = reader.get_batch(number)
+        batches.append({"codes": batch.column("token").indices.to_numpy(),
+                        "timestamp": batch.column("timestamp").to_numpy(),
+                        "id": batch.column("id").to_numpy(),
+                        "position": batch.column("position").to_numpy(),
+                        "threads": batch.column("thread_name").indices.to_numpy()})
+    tokens = batch.column("token")
+    threads = batch.column("thread_name")
+    return {"words": tokens.dictionary.to_numpy(zero_copy_only=False),
+            "batches": batches,
+            "firstcodes": np.array([columns["codes"][0] for columns in batches]),
+            "lastcodes": np.array([columns["codes"][-1] for columns in batches]),
+            "threadcodes": {name: code for code, name in enumerate(threads.dictionary.to_pylist())}}
+
+
+def searchMessages(index, query, range, thread=None):
+    ''' Finds the messages in the slider range (and thread, if given) with
+        the words of the query next to each other, as a phrase when there
+        are more of them. Every word costs a few binary searches and an
+        intersection of its postings in the range, starting from the rarest
+        one, so common words (e.g. "nie") in a phrase cost little. Returns
+        the ids and timestamps of the messages, or None if the query has no
+        searchable words.
+    '''
+    words = tokenizePositions(pd.Series([query]))
+    if len(words) == 0:
+        return None
+    empty = np.array([], dtype="int64"), np.array([], dtype="int64")
+    if thread and thread not in index["threadcodes"]:
+        return empty
+    postings = []
+    for token, position in zip(words["token"], words["position"]):
+        code = np.searchsorted(index["words"], token)
+        if code == len(index["words"]) or index["words"][code] != token:
+            return empty
+        # the batches the postings of the word are in, usually one
+        pieces = []
+        for columns in index["batches"][np.searchsorted(index["lastcodes"], code, side="left"):
+                                        np.searchsorted(index["firstcodes"], code, side="right")]:
+            start, end = np.searchsorted(columns["codes"], [code, code + 1])
+            first, last = rangeBounds(columns["timestamp"][start:end], range)
+            pieces.append((columns, start + first, start + last))
+        if len(pieces) == 0:
+            return empty
+        postings.append((sum(end - start for columns, start, end in pieces), pieces, position))
+    matches = None
+    for count, pieces, position in sorted(postings, key=lambda posting: posting[0]):
+        keys, times = [], []
+        for columns, start, end in pieces:
+            rows = slice(start, end)
+            keep = columns["threads"][rows] == index["threadcodes"][thread] if thread else slice(None)
+            # a message and where the phrase would start in it
+            keys.append((columns["id"][rows][keep] << 24)
+                        + (columns["position"][rows][keep].astype("int64") - position + 2**23))
+            times.append(columns["timestamp"][rows][keep])
+        keys = np.concatenate(keys)
+        if matches is None:
+            firstkeys, timestamps = keys, np.concatenate(times)
+            matches = keys
+        else:
+            matches = np.intersect1d(matches, keys)
+    found = np.isin(firstkeys, matches) if len(postings) > 1 else slice(None)
+    ids, unique = np.unique(firstkeys[found] >> 24, return_index=True)
+    return ids, timestamps[found][unique]
+
+
 def getMarks(start, end, Nth=100):
     ''' Returns the marks for labeling.
         Every Nth value will be used.
@@ -40,40 +381,142 @@ def getMarks(start, end, Nth=100):
     return {unixTimeMillis(m): (str(m.strftime('%Y-%m'))) for m in result}
 
 
-def generateMessageOwner(val, owner):
-    if val == owner:
-        return "Sent"
-    else:
-        return "Received"
+def generateMessageOwner(sent):
+    ''' Labels the rows written by the owner (a boolean mask) "Sent" and
+        the rest "Received", as a categorical of one byte codes.
+    '''
+    return pd.Categorical.from_codes((~sent).astype(np.int8), ["Sent", "Received"])
+
+
+def rangeDates(timestamps, start, end):
+    ''' Returns the local dates of the first and last of the sorted
+        timestamps [start, end). Local time goes back by an hour when DST
+        ends, so they are looked for among the first and last hour only.
+    '''
+    firstHour = np.searchsorted(timestamps, timestamps[start] + 3600, side="left")
+    lastHour = np.searchsorted(timestamps, timestamps[end - 1] - 3600, side="right")
+    return (timestampsToDates(pd.Series(timestamps[start:firstHour])).min(),
+            timestampsToDates(pd.Series(timestamps[lastHour:end])).max())
+
+def dayStart(timestamp):
+    ''' Returns the unix timestamp of the local midnight before a timestamp. '''
+    return unixTimeMillis(datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0))
+
+
+def wordcloudKey(data, thread, isowner, range):
+    ''' The word counts are kept per day, so a wordcloud only depends on the
+        days of the range. Its image is rendered and cached under this key,
+        which starts with the dataset it comes from.
+    '''
+    return (data.name, data.fingerprint, thread, isowner, dayStart(range[0]), dayStart(range[1]))
 
-def generatePersonWordCloudImage(thread, isowner, range):
-    wcimg = None
-    df_slice = df.loc[df["thread_name"] == thread]
-    start = datetime.fromtimestamp(range[0])
-    end = datetime.fromtimestamp(range[1])
 
-    date_list = pd.to_datetime(df_slice['date'].tolist())
-    mask = (date_list >= start) & (date_list <= end)
-    df_slice = df_slice.loc[mask]
+def wordcloudFrequencies(data, key):
+    ''' Sums the word counts of one side of a conversation in the key's days. '''
+    name, fingerprint, thread, isowner, start, end = key
+    tokens_slice = threadSlice(data.df_tokens, data.df_tokens_threads, thread, [start, end])
     if isowner:
-        text = df_slice.loc[df_slice["author"]
-                            == owner].content.str.cat(sep=" ")
+        tokens_slice = tokens_slice.loc[tokens_slice["author"] == data.owner]
     else:
-        text = df_slice.loc[df_slice["author"]
-                            != owner].content.str.cat(sep=" ")
-    if len(text) > 0:
-        wordcloud = WordCloud(
-            width=1200,
-            height=600,
-            background_color="white",
-            mode="RGBA",
-            stopwords=stop_words,
-            collocations=False,
-            colormap=mcolors.LinearSegmentedColormap.from_list('custom colormap', ['#47A8BD', '#FFAD69'], N=2)
-        ).generate(text)
-        wcimg = wordcloud.to_image()
-    return wcimg
+        tokens_slice = tokens_slice.loc[tokens_slice["author"] != data.owner]
+    frequencies = tokens_slice.groupby("token", observed=True)["count"].sum()
+    return normalizePlurals(frequencies.to_dict())
+
+
+def wordcloudFile(key):
+    ''' The key of a wordcloud in the figure cache of its dataset. '''
+    name, fingerprint, thread, isowner, start, end = key
+    return json.dumps(["wordcloud", thread, isowner, start, end])
+
+
+def storeWordcloud(key, future, figure_cache):
+    ''' Moves a finished render into the cache, and its png into the
+        figure cache of the dataset. Called by the pool, or for a cancelled
+        render by cancel() itself, in releaseWordcloud with wordcloud_lock
+        held, which also drops the job.
+    '''
+    if future.cancelled():
+        return
+    try:
+        image = future.result()
+        wordcloud_cache.put(key, image)
+        if figure_cache is not None and image:
+            figure_cache.put(wordcloudFile(key), uriToPng(image), ".png")
+    except Exception as error:
+        print(f"Rendering a wordcloud failed: {error!r}")
+        wordcloud_cache.put(key, "")
+    with wordcloud_lock:
+        if key in wordcloud_jobs and wordcloud_jobs[key][0] is future:
+            del wordcloud_jobs[key]
+
+
+def wordcloudPool():
+    ''' Returns the wordcloud pool of the current process, starting it on
+        first use. A pool does not survive a fork, so every server worker
+        starts its own. Called with wordcloud_lock held.
+    '''
+    global wordcloud_pool, wordcloud_pool_pid
+    if wordcloud_pool_pid != os.getpid():
+        wordcloud_jobs.clear()
+        wordcloud_pool = ProcessPoolExecutor(int(os.environ.get("WORDCLOUD_WORKERS", 2)))
+        wordcloud_pool_pid = os.getpid()
+    return wordcloud_pool
+
+
+def requestWordcloud(data, key):
+    ''' Starts rendering a wordcloud of a dataset in the pool, unless it is
+        cached (in memory or in the figure cache) or already being rendered
+        for someone else. Every request has to be matched by a
+        releaseWordcloud call.
+    '''
+    with wordcloud_lock:
+        if key in wordcloud_jobs:
+            wordcloud_jobs[key][1] += 1
+            return
+        if wordcloud_cache.get(key) is not None:
+            increment("wordcloud_cache_hits")
+            return
+        increment("wordcloud_cache_misses")
+        if data.figure_cache is not None:
+            png = data.figure_cache.get(wordcloudFile(key), ".png")
+            if png is not None:
+                increment("figure_cache_hits")
+                wordcloud_cache.put(key, pngToUri(png))
+                return
+        frequencies = wordcloudFrequencies(data, key)
+        if len(frequencies) == 0:
+            wordcloud_cache.put(key, "")
+            return
+        future = wordcloudPool().submit(renderWordcloud, frequencies)
+        wordcloud_jobs[key] = [future, 1]
+    future.add_done_callback(lambda future: storeWordcloud(key, future, data.figure_cache))
+
+
+def releaseWordcloud(key):
+    ''' Drops a request. A render nobody waits for any more is cancelled if
+        it has not started yet.
+    '''
+    with wordcloud_lock:
+        if key not in wordcloud_jobs:
+            return
+        wordcloud_jobs[key][1] -= 1
+        if wordcloud_jobs[key][1] <= 0 and wordcloud_jobs[key][0].cancel():
+            del wordcloud_jobs[key]
+
 
+def pollWordcloud(data, key):
+    ''' Returns the rendered image ("" if the side wrote nothing in the
+        period) or None while it is still being rendered.
+    '''
+    with wordcloud_lock:
+        if key in wordcloud_jobs:
+            return None
+    image = wordcloud_cache.get(key, count=False)
+    if image is None:
+        # evicted before it was shown, render it again
+        requestWordcloud(data, key)
+        image = wordcloud_cache.get(key, count=False)
+    return image
 
 
 
@@ -84,61 +527,299 @@ def generatePersonWordCloudImage(thread, isowner, range):
 # external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 
-# words not to include in the wordclouds sourced from
-# https://github.com/fergiemcdowall/stopword
-stop_words = [
-    'a', 'aby', 'ach', 'acz', 'aczkolwiek', 'aj', 'albo', 'ale', 'ależ', 'ani', 'sie',
-    'aż', 'bardziej', 'bardzo', 'bo', 'bowiem', 'by', 'byli', 'bynajmniej',
-    'być', 'był', 'była', 'było', 'były', 'będzie', 'będą', 'cali', 'cała',
-    'cały', 'ci', 'cię', 'ciebie', 'co', 'cokolwiek', 'coś', 'czasami',
-    'czasem', 'czemu', 'czy', 'czyli', 'daleko', 'dla', 'dlaczego', 'dlatego',
-    'do', 'dobrze', 'dokąd', 'dość', 'dużo', 'dwa', 'dwaj', 'dwie', 'dwoje',
-    'dziś', 'dzisiaj', 'gdy', 'gdyby', 'gdyż', 'gdzie', 'gdziekolwiek',
-    'gdzieś', 'i', 'ich', 'ile', 'im', 'inna', 'inne', 'inny', 'innych', 'iż',
-    'ja', 'ją', 'jak', 'jakaś', 'jakby', 'jaki', 'jakichś', 'jakie', 'jakiś',
-    'jakiż', 'jakkolwiek', 'jako', 'jakoś', 'je', 'jeden', 'jedna', 'jedno',
-    'jednak', 'jednakże', 'jego', 'jej', 'jemu', 'jest', 'jestem', 'jeszcze',
-    'jeśli', 'jeżeli', 'już', 'ją', 'każdy', 'kiedy', 'kilka', 'kimś', 'kto',
-    'ktokolwiek', 'ktoś', 'która', 'które', 'którego', 'której', 'który',
-    'których', 'którym', 'którzy', 'ku', 'lat', 'lecz', 'lub', 'ma', 'mają',
-    'mało', 'mam', 'mi', 'mimo', 'między', 'mną', 'mnie', 'mogą', 'moi', 'moim',
-    'moja', 'moje', 'może', 'możliwe', 'można', 'mój', 'mu', 'musi', 'my', 'na',
-    'nad', 'nam', 'nami', 'nas', 'nasi', 'nasz', 'nasza', 'nasze', 'naszego',
-    'naszych', 'natomiast', 'natychmiast', 'nawet', 'nią', 'nic', 'nich', 'nie',
-    'niech', 'niego', 'niej', 'niemu', 'nigdy', 'nim', 'nimi', 'niż', 'no', 'o',
-    'obok', 'od', 'około', 'on', 'ona', 'one', 'oni', 'ono', 'oraz', 'oto',
-    'owszem', 'pan', 'pana', 'pani', 'po', 'pod', 'podczas', 'pomimo', 'ponad',
-    'ponieważ', 'powinien', 'powinna', 'powinni', 'powinno', 'poza', 'prawie',
-    'przecież', 'przed', 'przede', 'przedtem', 'przez', 'przy', 'roku',
-    'również', 'sam', 'sama', 'są', 'się', 'skąd', 'sobie', 'sobą', 'sposób',
-    'swoje', 'ta', 'tak', 'taka', 'taki', 'takie', 'także', 'tam', 'te', 'tego',
-    'tej', 'temu', 'ten', 'teraz', 'też', 'to', 'tobą', 'tobie', 'toteż',
-    'trzeba', 'tu', 'tutaj', 'twoi', 'twoim', 'twoja', 'twoje', 'twym', 'twój',
-    'ty', 'tych', 'tylko', 'tym', 'u', 'w', 'wam', 'wami', 'was', 'wasz', 'zaś',
-    'wasza', 'wasze', 'we', 'według', 'wiele', 'wielu', 'więc', 'więcej', 'tę',
-    'wszyscy', 'wszystkich', 'wszystkie', 'wszystkim', 'wszystko', 'wtedy',
-    'wy', 'właśnie', 'z', 'za', 'zapewne', 'zawsze', 'ze', 'zł', 'znowu',
-    'znów', 'został', 'żaden', 'żadna', 'żadne', 'żadnych', 'że', 'żeby',
-    '$', '1', '2', '3', '4', '5', '6', '7', '8', '9', '0', '_']
-
 basedirectory = os.path.dirname(os.path.abspath(__file__))
 
-# getting the messages 'owners' name
-ownernamepath = os.path.join(basedirectory, "owner.txt")
-with open(ownernamepath, mode="r", encoding="utf-8") as ownerfile:
-    owner = ownerfile.read()
 
-# preparing reactions dataframe
-reactionfile = os.path.join(basedirectory, "reactions.csv")
-df_reactions = pd.read_csv(reactionfile)
-df_reactions["who"] = df_reactions["reacting_person"].apply(
-    generateMessageOwner, args=(owner,))
+def releaseMemory():
+    ''' Returns the memory freed after loading (parquet buffers, sorting and
+        grouping temporaries) to the OS. The allocators of Arrow and glibc
+        keep it for reuse otherwise, and forked workers would inherit it.
+    '''
+    pa.default_memory_pool().release_unused()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        # not glibc
+        pass
+
+
+def datasetFingerprint(directory):
+    ''' Returns the fingerprint generate.py writes with every new version of
+        a dataset, or the modification time of its tables if there is none
+        (older data, or an ingest in progress).
+    '''
+    try:
+        with open(os.path.join(directory, "fingerprint.txt"), encoding="utf-8") as fingerprintfile:
+            return fingerprintfile.read().strip()
+    except FileNotFoundError:
+        return str(os.stat(os.path.join(directory, "tokens.parquet")).st_mtime_ns)
+
+
+def codeVersion():
+    ''' A hash of the code drawing the figures and wordclouds. '''
+    digest = hashlib.sha256()
+    for function in (codeVersion, renderWordcloud, normalizePlurals):
+        with open(inspect.getsourcefile(function), "rb") as codefile:
+            digest.update(codefile.read())
+    return digest.hexdigest()[:12]
+
+
+def openFigureCache(directory, fingerprint):
+    ''' Opens the figure cache of a dataset in its figure_cache directory,
+        in a subdirectory of the fingerprint and the code version, and
+        deletes the caches of older data or code. Returns None if it is
+        disabled (FIGURE_CACHE_MB=0) or cannot be written.
+    '''
+    if figure_cache_bytes <= 0:
+        return None
+    cachedirectory = os.path.join(directory, "figure_cache")
+    name = fingerprint + "-" + code_version
+    try:
+        if os.path.isdir(cachedirectory):
+            for entry in os.scandir(cachedirectory):
+                if entry.name != name:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        return DiskCache(os.path.join(cachedirectory, name), figure_cache_bytes)
+    except OSError as error:
+        print(f"The figure cache of {directory} is disabled: {error!r}")
+        return None
+
+
+def figureCached(function):
+    ''' Keeps the outputs of a callback, whose last argument is the name of
+        the dataset, in the figure cache of the dataset, by the callback and
+        its other arguments. They are stored as the json Dash sends and
+        returned from the cache as plain dicts, which Dash sends the same.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args):
+        data = registry.get(args[-1])
+        if data.figure_cache is None:
+            return function(*args)
+        key = json.dumps([function.__name__] + list(args[:-1]))
+        with phase("figure_cache"):
+            cached = data.figure_cache.get(key, ".json")
+        if cached is not None:
+            increment("figure_cache_hits")
+            return json.loads(cached)
+        increment("figure_cache_misses")
+        result = function(*args)
+        with phase("figure_cache"):
+            from plotly.io.json import to_json_plotly
+            data.figure_cache.put(key, to_json_plotly(result).encode("utf-8"), ".json")
+        return result
+    return wrapper
+
+
+class Dataset:
+    ''' The tables written by generate.py in a directory, loaded for the
+        callbacks. The callbacks never modify them, so when a WSGI server
+        forks its workers after loading (gunicorn --preload) all workers
+        share one copy of the data.
+    '''
+
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+
+        # getting the messages 'owners' name
+        ownernamepath = os.path.join(directory, "owner.txt")
+        with open(ownernamepath, mode="r", encoding="utf-8") as ownerfile:
+            self.owner = ownerfile.read()
+
+        # preparing reactions dataframe
+        reactionfile = os.path.join(directory, "reactions.parquet")
+        self.df_reactions = loadTable(reactionfile, ["thread_name", "timestamp", "emoji", "reacting_person"])
+        self.reactions_cube = buildCube(self.df_reactions, ["thread_name", "emoji", "reacting_person"],
+                                        threads=True)
+        self.reactions_cube_threads = buildThreadIndex(self.reactions_cube)
+
+        # preparing main messages dataframe: the names as categoricals and the
+        # time as one unix timestamp, dates are computed only for what is shown
+        # and the texts are read from the file by the search tab
+        self.message_file = os.path.join(directory, "messages.parquet")
+        df = loadTable(self.message_file, ["thread_type", "thread_name", "author", "timestamp", "chars", "words"])
+        sent = (df["author"] == self.owner).to_numpy()
+
+        # running totals for the statistics of any range, the lengths of the
+        # messages are not needed after that
+        self.statistics_prefix = buildPrefixSums(df, sent)
+        self.df = df[["thread_type", "thread_name", "author", "timestamp"]]
+        self.df_timestamps = self.df["timestamp"].to_numpy()
+
+        # message counts per hour, for the whole inbox and for every thread
+        self.summary_cube = buildCube(pd.DataFrame({"timestamp": self.df["timestamp"],
+                                                    "who": generateMessageOwner(sent)}), ["who"])
+        self.thread_cube = buildCube(self.df, ["thread_name", "author"], threads=True)
+        self.thread_cube_threads = buildThreadIndex(self.thread_cube)
+
+        # the same counts per day, week and month, for the histograms over time
+        self.summary_buckets = buildTimeBuckets(self.summary_cube, "who")
+        self.thread_buckets = buildTimeBuckets(self.thread_cube, "author", threads=True)
+        self.thread_buckets_threads = {resolution: buildThreadIndex(table)
+                                       for resolution, table in self.thread_buckets.items()}
+        self.bucket_bounds = buildBucketBounds(self.summary_cube)
+
+        # word counts per thread, author and day, for the wordclouds
+        tokenfile = os.path.join(directory, "tokens.parquet")
+        self.df_tokens = narrowIntegers(loadTable(tokenfile, ["thread_name", "author", "timestamp", "token",
+                                                              "count"], threads=True), ["count"])
+        self.df_tokens_threads = buildThreadIndex(self.df_tokens)
+
+        # part of the cache keys, so figures of an older ingest are never reused
+        self.fingerprint = datasetFingerprint(directory)
+        self.figure_cache = openFigureCache(directory, self.fingerprint)
+
+        # word positions for the search tab, the texts of the found messages
+        # are read from messages.parquet
+        self.search_index = loadSearchIndex(os.path.join(directory, "search_index.arrow"))
+
+        # computed once, every page load builds a layout from them
+        self.first_date, self.last_date = rangeDates(self.df_timestamps, 0, len(self.df_timestamps))
+        self.full_range = [unixTimeMillis(self.first_date), unixTimeMillis(self.last_date)]
+        self.thread_options = [{"label": str(name), "value": str(name)} for name in
+                               self.df.loc[self.df["thread_type"] == "Regular"].thread_name.unique()]
+        self.all_thread_options = [{"label": str(name), "value": str(name)} for name in
+                                   self.df.thread_name.unique()]
+        self.marks = getMarks(self.first_date, self.last_date)
+        # with CLIENTSIDE_FILTERING the hourly counts sent to the browser with
+        # every page, as json encoded once (Dash would encode the lists again
+        # for every page)
+        self.summary_compact = json.dumps(compactCube(self.summary_cube, "who")) if clientside_filtering else None
+        releaseMemory()
+        self.size = self.memory()["total"]
+
+    def memory(self):
+        ''' Returns the memory used by the loaded tables, in bytes. The search
+            index is memory mapped and only counted as the size of the file.
+        '''
+        tables = {"df": self.df, "df_reactions": self.df_reactions, "reactions_cube": self.reactions_cube,
+                  "summary_cube": self.summary_cube, "thread_cube": self.thread_cube, "df_tokens": self.df_tokens}
+        memory = {name: int(table.memory_usage(deep=True).sum()) for name, table in tables.items()}
+        for name in ("summary_buckets", "thread_buckets"):
+            memory[name] = sum(int(table.memory_usage(deep=True).sum()) for table in getattr(self, name).values())
+        memory["statistics_prefix"] = sum(sums.nbytes for sums in self.statistics_prefix.values())
+        memory["bucket_bounds"] = sum(first.nbytes + starts.nbytes for first, starts in self.bucket_bounds.values())
+        memory["total"] = sum(memory.values())
+        if self.search_index is not None:
+            memory["search_index_mapped"] = sum(column.nbytes for columns in self.search_index["batches"]
+                                                for column in columns.values())
+        return memory
+
+
+def findDatasets(directory):
+    ''' Returns the datasets of a directory by name: the directory itself
+        if generate.py wrote into it, named after it, and every subdirectory
+        with a dataset (e.g. written by generate.py --anonymized), in order.
+        A subdirectory with the name of the directory is named with both.
+    '''
+    def isDataset(path):
+        return all(os.path.exists(os.path.join(path, name)) for name in ("owner.txt", "messages.parquet",
+                                                                          "reactions.parquet", "tokens.parquet"))
+
+    datasets = {}
+    rootname = os.path.basename(os.path.abspath(directory))
+    if isDataset(directory):
+        datasets[rootname] = directory
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and isDataset(path):
+            if name in datasets:
+                # a subdirectory named like the directory, e.g. --anonymized anon
+                # in anon, goes by its path
+                print(f"The dataset in {path} is named {rootname}/{name}, {name} is {directory}")
+                name = rootname + "/" + name
+            datasets[name] = path
+    return datasets
+
+
+class DatasetRegistry:
+    ''' The datasets the dashboard can show, by name. A dataset is loaded
+        on first use and the least recently used ones are dropped when the
+        loaded ones take more than maxbytes together (the one just used
+        always stays). Unknown names (e.g. None) get the first dataset.
+    '''
 
-# preparing main messages dataframe
-messagefile = os.path.join(basedirectory, "messages.csv")
-df = pd.read_csv(messagefile)
-df["who"] = df["author"].apply(generateMessageOwner, args=(owner,))
-df['dateformat'] = pd.to_datetime(df['date'])
+    def __init__(self, directories, maxbytes):
+        self.directories = directories
+        self.default = next(iter(directories))
+        self.maxbytes = maxbytes
+        self.loaded = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # one load of a dataset at a time, other datasets are served meanwhile
+        self.loading = {name: threading.Lock() for name in directories}
+
+    def names(self):
+        return list(self.directories)
+
+    def get(self, name):
+        if name not in self.directories:
+            name = self.default
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                return self.loaded[name]
+        with self.loading[name]:
+            with self.lock:
+                if name in self.loaded:
+                    return self.loaded[name]
+            dataset = Dataset(name, self.directories[name])
+            with self.lock:
+                self.loaded[name] = dataset
+                self.loads += 1
+                evicted = False
+                while len(self.loaded) > 1 and sum(data.size for data in self.loaded.values()) > self.maxbytes:
+                    self.loaded.popitem(last=False)
+                    self.evictions += 1
+                    evicted = True
+        if evicted:
+            releaseMemory()
+        return dataset
+
+    def stats(self):
+        with self.lock:
+            return {"datasets": self.names(), "maxbytes": self.maxbytes, "loads": self.loads,
+                    "evictions": self.evictions,
+                    "loaded": {name: data.memory() for name, data in self.loaded.items()}}
+
+
+# the datasets served, set by createApp; the memory budget of the loaded ones
+# can be changed with the DATASETS_MEMORY_MB environment variable and the
+# usage is shown on /dataset-memory
+registry = None
+
+# figures and wordclouds kept on disk across restarts, in the figure_cache
+# directory of every dataset; the budget (per dataset) can be changed with the
+# FIGURE_CACHE_MB environment variable, 0 turns it off, and the usage is shown
+# on /figure-cache
+figure_cache_bytes = int(os.environ.get("FIGURE_CACHE_MB", 256)) * 2**20
+code_version = codeVersion()
+
+# rendered wordclouds, the budget can be changed with the WORDCLOUD_CACHE_MB
+# environment variable and the usage is shown on /wordcloud-cache
+wordcloud_cache = LRUCache(int(os.environ.get("WORDCLOUD_CACHE_MB", 64)) * 2**20)
+
+# wordclouds are rendered in worker processes (WORDCLOUD_WORKERS, 2 by default
+# so both sides of a conversation render at once), the callbacks only poll
+# (see wordcloudPool)
+wordcloud_pool = None
+wordcloud_pool_pid = None
+# renders in progress, key -> [future, number of sessions waiting for it]
+wordcloud_jobs = {}
+wordcloud_lock = threading.Lock()
+
+# timings of the callbacks, served on /metrics and, if METRICS_LOG is set,
+# appended to that file as json lines
+callback_metrics = CallbackMetrics(os.environ.get("METRICS_LOG"))
+
+# with CLIENTSIDE_FILTERING=1 the hourly counts are sent to the browser and
+# the histograms follow the slider there, without asking the server
+clientside_filtering = os.environ.get("CLIENTSIDE_FILTERING", "0") == "1"
+
+# the latest found messages shown in the search tab
+SEARCH_RESULTS = 20
 
 # LAYOUT TEMPLATES FOR EACH TAB
 
@@ -156,7 +837,10 @@ tab2_layout = html.Div([
         children=[
             html.Div(id="person-time-histogram-container"),
             html.Div(id="person-hour-histogram-container"),
-            html.Div(id="person-wordclouds-container")
+            html.Div(id="person-wordclouds-container"),
+            dcc.Store(id="person-store"),
+            dcc.Store(id="wordcloud-job"),
+            dcc.Interval(id="wordcloud-interval", interval=300, disabled=True)
         ]
     )
 ])
@@ -169,91 +853,27 @@ tab3_layout = html.Div([
              ])
 ])
 
-# MAIN APP FUNCTIONALITY
-
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-
-app.config.suppress_callback_exceptions = True
-
-app.layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            dbc.Card(
-                dbc.CardBody(
-                    dbc.Tabs(id="tabs", active_tab="tab1", children=[
-                        dbc.Tab(label="Your summary", tab_id="tab1"),
-                        dbc.Tab(label="People", tab_id="tab2", children=[
-                            html.P("Select a person:"),
-                            dcc.Dropdown(
-                                id="person-dropdown",
-                                options=[{"label": str(name), "value": str(name)} for name in
-                                         df.loc[df["thread_type"] == "Regular"].thread_name.unique()])
-                        ]),
-                        dbc.Tab(label="Reactions", tab_id="tab3", children=[
-                            html.P("Select a person:"),
-                            dcc.Dropdown(
-                                id="reactions-dropdown",
-                                options=[{"label": str(name), "value": str(name)} for name in
-                                         df.loc[df["thread_type"] == "Regular"].thread_name.unique()])
-                        ])
-                    ])
-                ), className="mb-3"
-            ),
-            dbc.Card([
-                html.H3("Your Messenger Conversations", className="pt-4 px-4"),
-                dbc.CardBody(
-                    html.P(["We invite you to explore your Messenger conversation data. ",
-                            html.Br(),
-                            "Choose a time period, hover with your mouse over the plot, click on the legend ",
-                            "or go to a different tab. ",
-                           "After choosing a period please wait a few seconds for the plots to reload. ",
-                            html.Br(),
-                            html.Br(),
-                            "Authors: Katarzyna Solawa, Mikołaj Spytek, Mateusz Sperkowski"])
-                )]
-            )
-        ], md=3
-        ),
-        dbc.Col([
-            dbc.Card([
-                html.Div([
-                    html.H3("Choose a time period"),
-                    dcc.RangeSlider(
-                        id='year_slider1',
-                        min=unixTimeMillis(pd.to_datetime(df['date'].tolist()).min()),
-                        max=unixTimeMillis(pd.to_datetime(df['date'].tolist()).max()),
-                        value=[unixTimeMillis(pd.to_datetime(df['date'].tolist()).min()),
-                               unixTimeMillis(pd.to_datetime(df['date'].tolist()).max())],
-                        marks=getMarks(pd.to_datetime(df['date'].tolist()).min(),
-                                       pd.to_datetime(df['date'].tolist()).max()),
-                        step=86400,
-                        pushable=200000
-                    ),
-                    html.Div(id='slider-period1', className="mb-3")],
-                    className="pt-4 px-4")], className="mb-3"
-            ),
-            dbc.Card([
-                html.Div(id="content", className="pt-4 px-4")]
-            ), ], md=9, className="overflow-auto"
-        )
-    ])
-
-], fluid=True, className="pt-4")
-
+tab4_layout = html.Div([
+    html.H2("Search your messages"),
+    html.Div(id="search-container")
+])
 
 # CALLBACKS
 
 # General tab selection callback
 
 
-@app.callback(Output("content", "children"), Input("tabs", "active_tab"))
+@callback(Output("content", "children"), Input("tabs", "active_tab"))
+@instrumented
 def render_content(tab):
     if tab == "tab1":
         return tab1_layout
     elif tab == "tab2":
         return tab2_layout
-    else:
+    elif tab == "tab3":
         return tab3_layout
+    else:
+        return tab4_layout
 
 
 
@@ -265,64 +885,115 @@ def showPeriod(range):
     return f'Period from {start_label} to {end_label}'
 
 
+# Dataset selection: the page shows the dataset in its ?dataset= parameter
+# (the first one without it). The layout is the same for all datasets, the
+# slider and the dropdowns are set for the dataset of the page here, and
+# choosing another one in the dropdown changes the address without loading
+# the page again. dash-renderer fetches the layout without the parameters of
+# the page, so it could not be built for the dataset.
+
+
+@callback(Output("url", "search"),
+          Output("dataset-dropdown", "value"),
+          Output("year_slider1", "min"),
+          Output("year_slider1", "max"),
+          Output("year_slider1", "value"),
+          Output("year_slider1", "marks"),
+          Output("person-dropdown", "options"),
+          Output("person-dropdown", "value"),
+          Output("reactions-dropdown", "options"),
+          Output("reactions-dropdown", "value"),
+          Output("search-dropdown", "options"),
+          Output("search-dropdown", "value"),
+          Output("summary-store", "data"),
+          Input("url", "search"),
+          Input("dataset-dropdown", "value"))
+@instrumented
+def selectDataset(search, value):
+    if dash.ctx.triggered_id == "dataset-dropdown":
+        name, search, value = value, "?" + urlencode({"dataset": value}), dash.no_update
+    else:
+        name = parse_qs((search or "").lstrip("?")).get("dataset", [None])[0]
+        if name not in registry.names():
+            name = registry.default
+        if name == value:
+            # the layout is already the one of this dataset
+            raise PreventUpdate
+        search, value = dash.no_update, name
+    data = registry.get(name)
+    return (search, value, data.full_range[0], data.full_range[1], data.full_range, data.marks,
+            data.thread_options, None, data.thread_options, None, data.all_thread_options, None,
+            data.summary_compact)
+
+
 # Second tab callbacks
-@app.callback(Output("slider-period1", "children"),
-              Input("year_slider1", "value"),)
+@callback(Output("slider-period1", "children"),
+          Input("year_slider1", "value"),)
+@instrumented
 def showPeriod1(range):
     return showPeriod(range)
 
 
-@app.callback(Output("time-histogram-container", "children"),
-              Input("year_slider1", "value"),)
-def generalTimeHistogram(range):
-    start = datetime.fromtimestamp(range[0])
-    end = datetime.fromtimestamp(range[1])
-    date_list = pd.to_datetime(df['date'].tolist())
-    mask = (date_list >= start) & (date_list <= end)
-    df_slice = df.loc[mask]
-    if df_slice.size == 0:
+@figureCached
+def summaryTab(range, name):
+    ''' All outputs of the summary tab depend only on the range (and the
+        dataset), so they are computed in one callback sharing the slices.
+    '''
+    data = registry.get(name)
+    with phase("slice"):
+        cube_slice = timeSlice(data.summary_cube, hourRange(range))
+    return (generalTimeHistogram(cube_slice, data.summary_buckets), generalHourHistogram(cube_slice),
+            generateStatistics(data, range))
+
+
+def generalTimeHistogram(cube_slice, buckets):
+    if cube_slice.size == 0:
         return html.Div(children='No messages in this period', style={'textAlign': 'center'})
-    timeHistogram = px.histogram(df_slice, x="date", color="who",
-                                 color_discrete_sequence=[
-                                     "#47A8BD", "#FFAD69"], title="Your messages over time", labels={
-        "date": "Date", "who": "Messages:"})
-    timeHistogram.update_yaxes(title_text="Number of messages", fixedrange=True)
-    timeHistogram.update_xaxes(fixedrange=True)
-    timeHistogram.update_layout(hovermode="x",
-                                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                                legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
-    timeHistogram.update_traces(hovertemplate='Number of messages: %{y:f}')
+    with phase("aggregate"):
+        counts, resolution = timeBuckets(cube_slice, buckets, "who")
+    with phase("figure"):
+        import plotly.express as px
+        timeHistogram = px.bar(counts, x="bucket", y="count", color="who",
+                               color_discrete_sequence=[
+                                   "#47A8BD", "#FFAD69"], category_orders={"who": ["Sent", "Received"]},
+                               title="Your messages over time", labels={
+            "bucket": "Date", "who": "Messages:"})
+        timeHistogram.update_yaxes(title_text="Number of messages per " + resolution, fixedrange=True)
+        timeHistogram.update_xaxes(fixedrange=True, hoverformat=HOVER_FORMATS[resolution])
+        timeHistogram.update_layout(hovermode="x", bargap=0,
+                                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                                    legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
+        timeHistogram.update_traces(hovertemplate='Number of messages: %{y:f}')
     return dcc.Graph(
         id="default-histogram",
         figure=timeHistogram,
         config=dict(
             displayModeBar=False
         )
-    ),
-
-@app.callback(Output("hour-histogram-container", "children"),
-              Input("year_slider1", "value"),)
-def generalHourHistogram(range):
-    start = datetime.fromtimestamp(range[0])
-    end = datetime.fromtimestamp(range[1])
-    date_list = pd.to_datetime(df['date'].tolist())
-    mask = (date_list >= start) & (date_list <= end)
-    df_slice = df.loc[mask]
-    if df_slice.size == 0:
+    )
+
+
+def generalHourHistogram(cube_slice):
+    if cube_slice.size == 0:
         return html.Div(children='No messages in this period', style={'textAlign': 'center'})
 
-    hourHistogram = px.histogram(df_slice, x="hour", color="who", range_x=[-0.5, 23.5], nbins=24,
-                                 title="Breakdown of messages sent by hour",
-                                 color_discrete_sequence=[
-                                     "#47A8BD", "#FFAD69"],
-                                 labels={"who": "Messages: "})
-    hourHistogram.update_yaxes(title_text="Number of messages", fixedrange=True)
-    hourHistogram.update_xaxes(title_text="Hour of day", nticks=24, tickmode='linear',
-                               tick0=0.0, dtick=1.0, fixedrange=True)
-    hourHistogram.update_layout(hovermode="x", bargap=0.1,
-                                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                                legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
-    hourHistogram.update_traces(hovertemplate='Number of messages: %{y:f}')
+    with phase("aggregate"):
+        counts = countBy(cube_slice, ["hour", "who"])
+    with phase("figure"):
+        import plotly.express as px
+        hourHistogram = px.bar(counts, x="hour", y="count", color="who",
+                               range_x=[-0.5, 23.5],
+                               title="Breakdown of messages sent by hour",
+                               color_discrete_sequence=[
+                                   "#47A8BD", "#FFAD69"], category_orders={"who": ["Sent", "Received"]},
+                               labels={"who": "Messages: "})
+        hourHistogram.update_yaxes(title_text="Number of messages", fixedrange=True)
+        hourHistogram.update_xaxes(title_text="Hour of day", nticks=24, tickmode='linear',
+                                   tick0=0.0, dtick=1.0, fixedrange=True)
+        hourHistogram.update_layout(hovermode="x", bargap=0.1,
+                                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                                    legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
+        hourHistogram.update_traces(hovertemplate='Number of messages: %{y:f}')
 
     return dcc.Graph(
         id="hour-histogram",
@@ -331,33 +1002,33 @@ def generalHourHistogram(range):
             displayModeBar=False
         )
     )
-@app.callback(Output("statistic", "children"),
-              Input("year_slider1", "value"),)
-def generateStatistics(range):
-    start = datetime.fromtimestamp(range[0])
-    end = datetime.fromtimestamp(range[1])
-    date_list = pd.to_datetime(df['date'].tolist())
-    mask = (date_list >= start) & (date_list <= end)
-    df_slice = df.loc[mask]
-    if df_slice.size == 0:
+
+
+def mean(total, count):
+    return total / count if count else float("nan")
+
+
+def generateStatistics(data, range):
+    with phase("slice"):
+        start, end = rangeBounds(data.df_timestamps, range)
+    if start == end:
         return html.Div(children='No messages in this period', style={'textAlign': 'center'})
 
-    endDateString = df_slice["date"].max()
-    startDateString = df_slice["date"].min()
-    startDate = datetime.fromisoformat(startDateString)
-    endDate = datetime.fromisoformat(endDateString)
+    with phase("aggregate"):
+        startDate, endDate = rangeDates(data.df_timestamps, start, end)
+        sums = rangeSums(data.statistics_prefix, start, end)
     startDateFormated = startDate.strftime("%A, the %d. %B %Y")
     endDateFormated = endDate.strftime("%A, the %d. %B %Y")
-    numYourMsg = len(df_slice.loc[df_slice["author"] == owner])
-    numTheirMsg = len(df_slice.loc[df_slice["author"] != owner])
+    numYourMsg = sums[("Sent", "count")]
+    numTheirMsg = sums[("Received", "count")]
     daysNum = abs(endDate - startDate).days
     daysNum += 1
     avgYourMsgPerDay = numYourMsg / daysNum
-    avgYourWordCount = df_slice.loc[df_slice["author"] == owner, "words"].mean()
-    avgYourCharCount = df_slice.loc[df_slice["author"] == owner, "chars"].mean()
+    avgYourWordCount = mean(sums[("Sent", "words")], numYourMsg)
+    avgYourCharCount = mean(sums[("Sent", "chars")], numYourMsg)
     avgTheirMsgPerDay = numTheirMsg / daysNum
-    avgTheirWordCount = df_slice.loc[df_slice["author"] != owner, "words"].mean()
-    avgTheirCharCount = df_slice.loc[df_slice["author"] != owner, "chars"].mean()
+    avgTheirWordCount = mean(sums[("Received", "words")], numTheirMsg)
+    avgTheirCharCount = mean(sums[("Received", "chars")], numTheirMsg)
 
     return """
     ## Statistics
@@ -385,56 +1056,68 @@ def generateStatistics(range):
 
 
 
+@figureCached
+def statisticsTab(range, name):
+    return generateStatistics(registry.get(name), range)
 
-@app.callback(Output("person-time-histogram-container", "children"),
-              Input("person-dropdown", "value"),
-              Input("year_slider1", "value"))
-def personTimeHistogram(person, range):
-    if person:
-        df_slice = df.loc[df["thread_name"] == person]
-        start = datetime.fromtimestamp(range[0])
-        end = datetime.fromtimestamp(range[1])
-        date_list = pd.to_datetime(df_slice['date'].tolist())
-        mask = (date_list >= start) & (date_list <= end)
-        df_slice = df_slice.loc[mask]
-        if df_slice.size == 0:
-            return html.Div(children='No messages in this period', style={'textAlign': 'center'})
-
-        personTimeHistogram = px.histogram(df_slice, x="date", color="author",
+
+if clientside_filtering:
+    callback(Output("statistic", "children"),
+             Input("year_slider1", "value"),
+             Input("dataset-dropdown", "value"))(instrumented(statisticsTab))
+    clientside_callback(ClientsideFunction(namespace="plots", function_name="updateHistograms"),
+                        Output("default-histogram", "figure"),
+                        Output("hour-histogram", "figure"),
+                        Input("year_slider1", "value"),
+                        Input("summary-store", "data"),
+                        State("default-histogram", "figure"),
+                        State("hour-histogram", "figure"))
+else:
+    callback(Output("time-histogram-container", "children"),
+             Output("hour-histogram-container", "children"),
+             Output("statistic", "children"),
+             Input("year_slider1", "value"),
+             Input("dataset-dropdown", "value"))(instrumented(summaryTab))
+
+
+def personTimeGraph(cube_slice, buckets):
+    if cube_slice.size == 0:
+        return html.Div(children='No messages in this period', style={'textAlign': 'center'})
+
+    with phase("aggregate"):
+        counts, resolution = timeBuckets(cube_slice, buckets, "author")
+    with phase("figure"):
+        import plotly.express as px
+        personTimeHistogram = px.bar(counts, x="bucket", y="count", color="author",
                                  color_discrete_sequence=[
                                      "#47A8BD", "#FFAD69"],
                                            labels={"author": "Author: "},
                                            title="Your conversation through the time period")
-        personTimeHistogram.update_yaxes(title_text="Number of messages", fixedrange=True)
-        personTimeHistogram.update_xaxes(title_text="Date", fixedrange=True)
-        personTimeHistogram.update_layout(hovermode="x", legend=dict(orientation="h", yanchor="bottom", y=1.02,
+        personTimeHistogram.update_yaxes(title_text="Number of messages per " + resolution, fixedrange=True)
+        personTimeHistogram.update_xaxes(title_text="Date", fixedrange=True, hoverformat=HOVER_FORMATS[resolution])
+        personTimeHistogram.update_layout(hovermode="x", bargap=0, legend=dict(orientation="h", yanchor="bottom", y=1.02,
                                                                      xanchor="right", x=1),
                                           legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
         personTimeHistogram.update_traces(
             hovertemplate='Number of messages: %{y:f}')
-        return dcc.Graph(
-            id="person-histogram",
-            figure=personTimeHistogram,
-            config=dict(
-                displayModeBar=False
-            )
+    return dcc.Graph(
+        id="person-histogram",
+        figure=personTimeHistogram,
+        config=dict(
+            displayModeBar=False
         )
+    )
 
 
-@app.callback(Output("person-hour-histogram-container", "children"),
-              Input("person-dropdown", "value"),
-              Input("year_slider1", "value"))
-def personHourHistogram(person, range):
-    if person:
-        df_slice = df.loc[df["thread_name"] == person]
-        start = datetime.fromtimestamp(range[0])
-        end = datetime.fromtimestamp(range[1])
-        date_list = pd.to_datetime(df_slice['date'].tolist())
-        mask = (date_list >= start) & (date_list <= end)
-        df_slice = df_slice.loc[mask]
-        if df_slice.size == 0:
-            return html.Div(children='No messages in this period', style={'textAlign': 'center'})
-        personHourHistogram = px.histogram(df_slice, x="hour", color="author", range_x=[-0.5, 23.5], nbins=24,
+def personHourGraph(cube_slice):
+    if cube_slice.size == 0:
+        return html.Div(children='No messages in this period', style={'textAlign': 'center'})
+    with phase("aggregate"):
+        counts = countBy(cube_slice, ["hour", "author"])
+    with phase("figure"):
+        import plotly.express as px
+        personHourHistogram = px.bar(counts, x="hour", y="count", color="author",
+                                           range_x=[-0.5, 23.5],
                                            title="Breakdown of messages sent by hour",
                                  color_discrete_sequence=[
                                      "#47A8BD", "#FFAD69"], labels={"author": "Author: "})
@@ -447,89 +1130,171 @@ def personHourHistogram(person, range):
         personHourHistogram.update_traces(
             hovertemplate='Number of messages: %{y:f}')
 
-        return dcc.Graph(
-            id="person-hour-histogram",
-            figure=personHourHistogram,
-            config=dict(
-                displayModeBar=False
-            )
+    return dcc.Graph(
+        id="person-hour-histogram",
+        figure=personHourHistogram,
+        config=dict(
+            displayModeBar=False
         )
+    )
 
 
+@figureCached
+def personCharts(person, name):
+    ''' Draws the histograms of a thread over all of its messages and sends
+        its hourly counts to the browser, which follows the slider from there.
+    '''
+    data = registry.get(name)
+    if not person or person not in data.thread_cube_threads:
+        return None, None, None
+    with phase("slice"):
+        cube_slice = threadSlice(data.thread_cube, data.thread_cube_threads, person)
+    with phase("aggregate"):
+        compact = compactCube(cube_slice, "author")
+    return personTimeGraph(cube_slice, threadBuckets(data, person)), personHourGraph(cube_slice), compact
+
+
+@figureCached
+def personTimeHistogram(person, range, name):
+    if person:
+        data = registry.get(name)
+        with phase("slice"):
+            cube_slice = threadSlice(data.thread_cube, data.thread_cube_threads, person, hourRange(range))
+        return personTimeGraph(cube_slice, threadBuckets(data, person))
 
-@app.callback(Output("person-wordclouds-container", "children"),
-              Input("person-dropdown", "value"),
-              Input("year_slider1", "value"))
-def personWordclouds(person, range):
+
+@figureCached
+def personHourHistogram(person, range, name):
     if person:
-        yourWordcloud = generatePersonWordCloudImage(person, True, range)
-        theirWordcloud = generatePersonWordCloudImage(person, False, range)
+        data = registry.get(name)
+        with phase("slice"):
+            cube_slice = threadSlice(data.thread_cube, data.thread_cube_threads, person, hourRange(range))
+        return personHourGraph(cube_slice)
+
+
+if clientside_filtering:
+    callback(Output("person-time-histogram-container", "children"),
+             Output("person-hour-histogram-container", "children"),
+             Output("person-store", "data"),
+             Input("person-dropdown", "value"),
+             Input("dataset-dropdown", "value"))(instrumented(personCharts))
+    clientside_callback(ClientsideFunction(namespace="plots", function_name="updateHistograms"),
+                        Output("person-histogram", "figure"),
+                        Output("person-hour-histogram", "figure"),
+                        Input("year_slider1", "value"),
+                        Input("person-store", "data"),
+                        State("person-histogram", "figure"),
+                        State("person-hour-histogram", "figure"))
+else:
+    callback(Output("person-time-histogram-container", "children"),
+             Input("person-dropdown", "value"),
+             Input("year_slider1", "value"),
+             Input("dataset-dropdown", "value"))(instrumented(personTimeHistogram))
+    callback(Output("person-hour-histogram-container", "children"),
+             Input("person-dropdown", "value"),
+             Input("year_slider1", "value"),
+             Input("dataset-dropdown", "value"))(instrumented(personHourHistogram))
+
+
+def wordcloudImage(title, image, padding):
+    if image is None:
+        content = html.P("Rendering the wordcloud...", style={"paddingTop": "20%"})
+    else:
+        content = html.Img(src=image or None, style={"display": "block", "width": "100%"})
+    return html.Div(
+        children=[
+            html.H2(
+                children=[title]),
+            content
+        ],
+        style={"display": "inline-block", "marginLeft": "auto",
+               "marginRight": "auto", "width": "40%", padding: "3%"}
+    )
+
 
-        return html.Div(id="wordcloud-container",
+def updateWordclouds(data, person, range, polling, job):
+    ''' Returns the wordclouds, the render job of the session and whether to
+        stop polling. A new person, range or dataset requests new renders and
+        cancels the ones of the previous job nobody else waits for. Images
+        that are not ready yet are shown as placeholders until a poll finds
+        them.
+    '''
+    keys = [tuple(key) for key in job["keys"]] if job else []
+    if not polling:
+        newkeys = [wordcloudKey(data, person, True, range),
+                   wordcloudKey(data, person, False, range)] if person else []
+        for key in newkeys:
+            if key not in keys:
+                requestWordcloud(data, key)
+        for key in keys:
+            if key not in newkeys:
+                releaseWordcloud(key)
+        keys = newkeys
+    if not keys:
+        return None, None, True
+
+    images = [pollWordcloud(data, key) for key in keys]
+    done = all(image is not None for image in images)
+    children = html.Div(id="wordcloud-container",
                         children=html.Div(
                             children=[
-                                html.Div(
-                                    children=[
-                                        html.H2(
-                                            children=["Your wordcloud"]),
-                                        html.Img(src=yourWordcloud, style={
-                                            "display": "block", "width": "100%"})
-                                    ],
-                                    style={"display": "inline-block", "marginLeft": "auto",
-                                           "marginRight": "auto", "width": "40%", "paddingRight": "3%"}
-                                ),
-                                html.Div(
-                                    children=[
-                                        html.H2(
-                                            children=["Their wordcloud"]),
-                                        html.Img(src=theirWordcloud, style={
-                                            "display": "block", "width": "100%"})
-                                    ],
-                                    style={"display": "inline-block", "marginLeft": "auto",
-                                           "marginRight": "auto", "width": "40%", "paddingLeft": "3%"}
-                                )
-
+                                wordcloudImage("Your wordcloud", images[0], "paddingRight"),
+                                wordcloudImage("Their wordcloud", images[1], "paddingLeft")
                             ],
                             style={"textAlign": "center"}
                         )
                         )
+    return children, None if done else {"keys": keys}, done
+
+
+@callback(Output("person-wordclouds-container", "children"),
+          Output("wordcloud-job", "data"),
+          Output("wordcloud-interval", "disabled"),
+          Input("person-dropdown", "value"),
+          Input("year_slider1", "value"),
+          Input("wordcloud-interval", "n_intervals"),
+          Input("dataset-dropdown", "value"),
+          State("wordcloud-job", "data"))
+@instrumented
+def personWordclouds(person, range, n_intervals, name, job):
+    triggered = [trigger["prop_id"] for trigger in dash.callback_context.triggered]
+    polling = triggered == ["wordcloud-interval.n_intervals"]
+    if polling and not job:
+        raise PreventUpdate
+    return updateWordclouds(registry.get(name), person, range, polling, job)
 
 
 # third tab callbacks
 
-@app.callback(Output("reactions-container", "children"),
-              Input("reactions-dropdown", "value"),
-              Input("year_slider1", "value"))
-def chatReactions(person, range):
+@figureCached
+def chatReactions(person, range, name):
     if person:
-        df_sl = df_reactions.loc[df_reactions["thread_name"] == person]
-
-        start = datetime.fromtimestamp(range[0])
-        end = datetime.fromtimestamp(range[1])
-        date_list = pd.to_datetime(df_sl['date'].tolist())
-        mask = (date_list >= start) & (date_list <= end)
-        df_sl = df_sl.loc[mask]
-        if df_sl.size == 0:
+        data = registry.get(name)
+        with phase("slice"):
+            cube_slice = threadSlice(data.reactions_cube, data.reactions_cube_threads, person, hourRange(range))
+        if cube_slice.size == 0:
             return html.Div(children='No reactions in this period', style={'textAlign': 'center'})
 
-        top = df_sl.groupby(["emoji", "reacting_person"]).size()
-        top = top.reset_index(level=['emoji', 'reacting_person']).rename(columns={0: "count"})
-        top = top.loc[top["count"] > 0]
+        with phase("aggregate"):
+            top = countBy(cube_slice, ["emoji", "reacting_person"])
+            top = top.loc[top["count"] > 0]
         if top.size == 0:
             return html.Div(children='No reactions in this period', style={'textAlign': 'center'})
-        mostMessagesHistogram = px.bar(top,
-                                       y="emoji", x="count", orientation="h",
-                                 color_discrete_sequence=[
-                                     "#47A8BD", "#FFAD69"], color="reacting_person",
-                                       title=f"Your reactions in chat with {person}",
-                                       labels={"reacting_person": "Person who reacted: "})
-        mostMessagesHistogram.update_yaxes(title_text="Emoji", categoryorder="total ascending", fixedrange=True)
-        mostMessagesHistogram.update_xaxes(title_text="Number of reactions", fixedrange=True)
-        mostMessagesHistogram.update_layout(hovermode="closest",
-                                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                                            legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
-        mostMessagesHistogram.update_traces(
-            hovertemplate='Number of reactions: %{x:f}, %{y}')
+        with phase("figure"):
+            import plotly.express as px
+            mostMessagesHistogram = px.bar(top,
+                                           y="emoji", x="count", orientation="h",
+                                     color_discrete_sequence=[
+                                         "#47A8BD", "#FFAD69"], color="reacting_person",
+                                           title=f"Your reactions in chat with {person}",
+                                           labels={"reacting_person": "Person who reacted: "})
+            mostMessagesHistogram.update_yaxes(title_text="Emoji", categoryorder="total ascending", fixedrange=True)
+            mostMessagesHistogram.update_xaxes(title_text="Number of reactions", fixedrange=True)
+            mostMessagesHistogram.update_layout(hovermode="closest",
+                                                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                                                legend_title=dict(font=dict(size=15)), title=dict(font=dict(size=23)))
+            mostMessagesHistogram.update_traces(
+                hovertemplate='Number of reactions: %{x:f}, %{y}')
 
         return dcc.Graph(id="mostMessages",
                          figure=mostMessagesHistogram,
@@ -539,5 +1304,251 @@ def chatReactions(person, range):
                          )
 
 
+callback(Output("reactions-container", "children"),
+         Input("reactions-dropdown", "value"),
+         Input("year_slider1", "value"),
+         Input("dataset-dropdown", "value"))(instrumented(chatReactions))
+
+
+# fourth tab callbacks
+
+@callback(Output("search-container", "children"),
+          Input("search-input", "value"),
+          Input("search-dropdown", "value"),
+          Input("year_slider1", "value"),
+          Input("dataset-dropdown", "value"))
+@instrumented
+def searchTab(query, thread, range, name):
+    if not query:
+        return html.Div(children='Type a word or a phrase to search for', style={'textAlign': 'center'})
+    data = registry.get(name)
+    if data.search_index is None:
+        return html.Div(children='No search index, please run generate.py again', style={'textAlign': 'center'})
+    with phase("slice"):
+        found = searchMessages(data.search_index, query, range, thread)
+    if found is None:
+        return html.Div(children='The query has no words to search for',
+                        style={'textAlign': 'center'})
+    ids, timestamps = found
+    if len(ids) == 0:
+        return html.Div(children='No messages found in this period', style={'textAlign': 'center'})
+
+    with phase("aggregate"):
+        resolution = timeResolution(int(timestamps.max()) - int(timestamps.min()) + 3600)
+        first, starts = data.bucket_bounds[resolution]
+        buckets, counts = np.unique(np.searchsorted(first, timestamps, side="right") - 1, return_counts=True)
+        latest = ids[np.argsort(timestamps)[::-1][:SEARCH_RESULTS]]
+        messages = pq.read_table(data.message_file, columns=["id", "thread_name", "author", "timestamp", "content"],
+                                 filters=[("id", "in", latest.tolist())]).to_pandas()
+        messages = messages.sort_values("timestamp", ascending=False)
+        messages["date"] = timestampsToDates(messages["timestamp"]).dt.strftime('%Y-%m-%d %H:%M')
+    with phase("figure"):
+        import plotly.express as px
+        searchHistogram = px.bar(x=starts[buckets], y=counts, color_discrete_sequence=["#47A8BD"],
+                               title=f"Messages with \"{query}\"")
+        searchHistogram.update_yaxes(title_text="Number of messages per " + resolution, fixedrange=True)
+        searchHistogram.update_xaxes(title_text="Date", fixedrange=True, hoverformat=HOVER_FORMATS[resolution])
+        searchHistogram.update_layout(hovermode="x", bargap=0, title=dict(font=dict(size=23)))
+        searchHistogram.update_traces(hovertemplate='Number of messages: %{y}')
+        table = dbc.Table.from_dataframe(
+            messages[["date", "thread_name", "author", "content"]].rename(
+                columns={"date": "Date", "thread_name": "Conversation", "author": "Author", "content": "Message"}),
+            striped=True, size="sm")
+
+    return html.Div([
+        html.P(f"Found {len(ids)} messages, the latest {len(messages)}:"),
+        dcc.Graph(id="search-histogram", figure=searchHistogram, config=dict(displayModeBar=False)),
+        table
+    ])
+
+
+# MAIN APP FUNCTIONALITY
+
+
+def createApp(directory=basedirectory):
+    ''' App factory: finds the datasets of a directory (see findDatasets),
+        loads the first one and builds the app. The callbacks are registered
+        globally and attached to the first app created, so it is meant to be
+        called once per process.
+    '''
+    global registry
+    datasets = findDatasets(directory)
+    if not datasets:
+        raise FileNotFoundError(f"No dataset in {directory}, please run generate.py first")
+    registry = DatasetRegistry(datasets, int(os.environ.get("DATASETS_MEMORY_MB", 4096)) * 2**20)
+    default = registry.get(None)
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+
+    app.config.suppress_callback_exceptions = True
+
+    callback_metrics.install(app.server)
+
+    @app.server.route("/wordcloud-cache")
+    def wordcloudCacheStats():
+        return app.server.response_class(json.dumps(wordcloud_cache.stats()), mimetype="application/json")
+
+    @app.server.route("/figure-cache")
+    def figureCacheStats():
+        stats = {name: data.figure_cache.stats() for name, data in registry.loaded.items()
+                 if data.figure_cache is not None}
+        return app.server.response_class(json.dumps(stats), mimetype="application/json")
+
+    @app.server.route("/dataset-memory")
+    def datasetMemoryStats():
+        return app.server.response_class(json.dumps(registry.stats()), mimetype="application/json")
+
+    if clientside_filtering:
+        # the histograms are drawn once, then only their bars are recomputed
+        # in the browser, from the counts of the dataset of the page
+        tab1_layout["time-histogram-container"].children = generalTimeHistogram(default.summary_cube,
+                                                                                default.summary_buckets)
+        tab1_layout["hour-histogram-container"].children = generalHourHistogram(default.summary_cube)
+
+    # the layout of the first dataset, selectDataset sets it for the dataset
+    # of the page
+    data = default
+    app.layout = dbc.Container([
+        dcc.Location(id="url", refresh=False),
+        dbc.Row([
+            dbc.Col([
+                dbc.Card(
+                    dbc.CardBody([
+                        html.P("Select an inbox:"),
+                        dcc.Dropdown(
+                            id="dataset-dropdown",
+                            options=registry.names(),
+                            value=data.name,
+                            clearable=False)
+                    ]), className="mb-3", style={} if len(registry.names()) > 1 else {"display": "none"}
+                ),
+                dbc.Card(
+                    dbc.CardBody(
+                        dbc.Tabs(id="tabs", active_tab="tab1", children=[
+                            dbc.Tab(label="Your summary", tab_id="tab1"),
+                            dbc.Tab(label="People", tab_id="tab2", children=[
+                                html.P("Select a person:"),
+                                dcc.Dropdown(
+                                    id="person-dropdown",
+                                    options=data.thread_options)
+                            ]),
+                            dbc.Tab(label="Reactions", tab_id="tab3", children=[
+                                html.P("Select a person:"),
+                                dcc.Dropdown(
+                                    id="reactions-dropdown",
+                                    options=data.thread_options)
+                            ]),
+                            dbc.Tab(label="Search", tab_id="tab4", children=[
+                                html.P("Search for a word or a phrase:"),
+                                dcc.Input(id="search-input", type="text", debounce=True,
+                                          className="form-control"),
+                                html.P("In a conversation (optional):", className="mt-2"),
+                                dcc.Dropdown(
+                                    id="search-dropdown",
+                                    options=data.all_thread_options)
+                            ])
+                        ])
+                    ), className="mb-3"
+                ),
+                dbc.Card([
+                    html.H3("Your Messenger Conversations", className="pt-4 px-4"),
+                    dbc.CardBody(
+                        html.P(["We invite you to explore your Messenger conversation data. ",
+                                html.Br(),
+                                "Choose a time period, hover with your mouse over the plot, click on the legend ",
+                                "or go to a different tab. ",
+                               "After choosing a period please wait a few seconds for the plots to reload. ",
+                                html.Br(),
+                                html.Br(),
+                                "Authors: Katarzyna Solawa, Mikołaj Spytek, Mateusz Sperkowski"])
+                    )]
+                )
+            ], md=3
+            ),
+            dbc.Col([
+                dbc.Card([
+                    html.Div([
+                        html.H3("Choose a time period"),
+                        dcc.RangeSlider(
+                            id='year_slider1',
+                            min=data.full_range[0],
+                            max=data.full_range[1],
+                            value=data.full_range,
+                            marks=data.marks,
+                            step=86400,
+                            pushable=200000
+                        ),
+                        html.Div(id='slider-period1', className="mb-3")],
+                        className="pt-4 px-4")], className="mb-3"
+                ),
+                dbc.Card([
+                    html.Div(id="content", className="pt-4 px-4")]
+                ), ], md=9, className="overflow-auto"
+            )
+        ]),
+        dcc.Store(id="summary-store", data=data.summary_compact)
+
+    ], fluid=True, className="pt-4")
+    return app
+
+
+def createServer(directory=basedirectory):
+    ''' WSGI entry point, e.g. gunicorn --preload -w 4 "plots:createServer()".
+        With --preload the first dataset is loaded once, before the workers
+        fork, the others are loaded by every worker when it needs them.
+    '''
+    return createApp(directory).server
+
+
+def warmUp():
+    ''' Draws the views of the whole period of every dataset and of all of
+        its Regular threads, with their wordclouds, into the figure caches,
+        so the first visitors after an ingest or a restart get them from
+        the disk. Meant to be run once, after createApp.
+    '''
+    for name in registry.names():
+        data = registry.get(name)
+        if data.figure_cache is None:
+            continue
+        start = time.perf_counter()
+        full = data.full_range
+        if clientside_filtering:
+            statisticsTab(full, name)
+        else:
+            summaryTab(full, name)
+        keys = []
+        for option in data.thread_options:
+            person = option["value"]
+            if clientside_filtering:
+                personCharts(person, name)
+            else:
+                personTimeHistogram(person, full, name)
+                personHourHistogram(person, full, name)
+            chatReactions(person, full, name)
+            for isowner in (True, False):
+                key = wordcloudKey(data, person, isowner, full)
+                requestWordcloud(data, key)
+                keys.append(key)
+        for key in keys:
+            while pollWordcloud(data, key) is None:
+                time.sleep(0.05)
+            releaseWordcloud(key)
+        print(name + ": zapisano widoki " + str(len(data.thread_options)) + " rozmów w " +
+              "{:.1f}".format(time.perf_counter() - start) + " s")
+    with wordcloud_lock:
+        pool = wordcloudPool()
+    pool.shutdown()
+
+
 if __name__ == "__main__":
-    app.run_server(debug=False)
+    parser = argparse.ArgumentParser(description="Serves the dashboard of the data written by generate.py")
+    parser.add_argument("directory", nargs="?", default=basedirectory,
+                        help="the directory generate.py wrote to (default: the one of this script)")
+    parser.add_argument("--warmup", action="store_true",
+                        help="draw the views of the whole period of all conversations into the figure cache "
+                             "and exit, instead of serving")
+    args = parser.parse_args()
+    app = createApp(args.directory)
+    if args.warmup:
+        warmUp()
+    else:
+        app.run_server(debug=False)
@@ -0,0 +1,91 @@
+import pandas as pd
+
+# words not to include in the wordclouds sourced from
+# https://github.com/fergiemcdowall/stopword
+stop_words = [
+    'a', 'aby', 'ach', 'acz', 'aczkolwiek', 'aj', 'albo', 'ale', 'ależ', 'ani', 'sie',
+    'aż', 'bardziej', 'bardzo', 'bo', 'bowiem', 'by', 'byli', 'bynajmniej',
+    'być', 'był', 'była', 'było', 'były', 'będzie', 'będą', 'cali', 'cała',
+    'cały', 'ci', 'cię', 'ciebie', 'co', 'cokolwiek', 'coś', 'czasami',
+    'czasem', 'czemu', 'czy', 'czyli', 'daleko', 'dla', 'dlaczego', 'dlatego',
+    'do', 'dobrze', 'dokąd', 'dość', 'dużo', 'dwa', 'dwaj', 'dwie', 'dwoje',
+    'dziś', 'dzisiaj', 'gdy', 'gdyby', 'gdyż', 'gdzie', 'gdziekolwiek',
+    'gdzieś', 'i', 'ich', 'ile', 'im', 'inna', 'inne', 'inny', 'innych', 'iż',
+    'ja', 'ją', 'jak', 'jakaś', 'jakby', 'jaki', 'jakichś', 'jakie', 'jakiś',
+    'jakiż', 'jakkolwiek', 'jako', 'jakoś', 'je', 'jeden', 'jedna', 'jedno',
+    'jednak', 'jednakże', 'jego', 'jej', 'jemu', 'jest', 'jestem', 'jeszcze',
+    'jeśli', 'jeżeli', 'już', 'ją', 'każdy', 'kiedy', 'kilka', 'kimś', 'kto',
+    'ktokolwiek', 'ktoś', 'która', 'które', 'którego', 'której', 'który',
+    'których', 'którym', 'którzy', 'ku', 'lat', 'lecz', 'lub', 'ma', 'mają',
+    'mało', 'mam', 'mi', 'mimo', 'między', 'mną', 'mnie', 'mogą', 'moi', 'moim',
+    'moja', 'moje', 'może', 'możliwe', 'można', 'mój', 'mu', 'musi', 'my', 'na',
+    'nad', 'nam', 'nami', 'nas', 'nasi', 'nasz', 'nasza', 'nasze', 'naszego',
+    'naszych', 'natomiast', 'natychmiast', 'nawet', 'nią', 'nic', 'nich', 'nie',
+    'niech', 'niego', 'niej', 'niemu', 'nigdy', 'nim', 'nimi', 'niż', 'no', 'o',
+    'obok', 'od', 'około', 'on', 'ona', 'one', 'oni', 'ono', 'oraz', 'oto',
+    'owszem', 'pan', 'pana', 'pani', 'po', 'pod', 'podczas', 'pomimo', 'ponad',
+    'ponieważ', 'powinien', 'powinna', 'powinni', 'powinno', 'poza', 'prawie',
+    'przecież', 'przed', 'przede', 'przedtem', 'przez', 'przy', 'roku',
+    'również', 'sam', 'sama', 'są', 'się', 'skąd', 'sobie', 'sobą', 'sposób',
+    'swoje', 'ta', 'tak', 'taka', 'taki', 'takie', 'także', 'tam', 'te', 'tego',
+    'tej', 'temu', 'ten', 'teraz', 'też', 'to', 'tobą', 'tobie', 'toteż',
+    'trzeba', 'tu', 'tutaj', 'twoi', 'twoim', 'twoja', 'twoje', 'twym', 'twój',
+    'ty', 'tych', 'tylko', 'tym', 'u', 'w', 'wam', 'wami', 'was', 'wasz', 'zaś',
+    'wasza', 'wasze', 'we', 'według', 'wiele', 'wielu', 'więc', 'więcej', 'tę',
+    'wszyscy', 'wszystkich', 'wszystkie', 'wszystkim', 'wszystko', 'wtedy',
+    'wy', 'właśnie', 'z', 'za', 'zapewne', 'zawsze', 'ze', 'zł', 'znowu',
+    'znów', 'został', 'żaden', 'żadna', 'żadne', 'żadnych', 'że', 'żeby',
+    '$', '1', '2', '3', '4', '5', '6', '7', '8', '9', '0', '_']
+
+# the pattern WordCloud uses to split a text into words
+TOKEN_PATTERN = r"\w[\w']*"
+
+stop_words_set = set(stop_words)
+
+
+def splitWords(contents):
+    ''' Splits a column of message texts into lowercase words, one row per
+        word indexed like the message it comes from, in order.
+    '''
+    return contents.str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+
+
+def filterWords(words):
+    ''' Drops a trailing 's and leaves out numbers and the stop words, like WordCloud. '''
+    words = words.where(~words.str.endswith("'s"), words.str[:-2])
+    return words.loc[(words != "") & ~words.str.isdigit() & ~words.isin(stop_words_set)]
+
+
+def tokenizeColumn(contents):
+    ''' Splits a column of message texts into words the same way WordCloud
+        does (dropping a trailing 's, numbers and the stop words), but in
+        lowercase. Returns a Series with one row per word, indexed like
+        the message it comes from.
+    '''
+    return filterWords(splitWords(contents))
+
+
+def tokenizePositions(contents):
+    ''' Splits a column of message texts into the words of the search index:
+        returns a DataFrame of the words ("token", lowercase, without a
+        trailing 's) and their positions in their message ("position").
+        Unlike tokenizeColumn, numbers and stop words are kept, so that a
+        phrase only matches where all of its words stand.
+    '''
+    words = splitWords(contents)
+    positions = words.groupby(level=0).cumcount()
+    words = words.where(~words.str.endswith("'s"), words.str[:-2])
+    keep = (words != "").to_numpy()
+    return pd.DataFrame({"token": words.to_numpy()[keep], "position": positions.to_numpy()[keep]},
+                        index=words.index[keep])
+
+
+def normalizePlurals(frequencies):
+    ''' Merges the counts of "words" into "word" when both occur, like
+        WordCloud does when it counts words itself.
+    '''
+    frequencies = dict(frequencies)
+    for word in list(frequencies):
+        if word.endswith("s") and not word.endswith("ss") and word[:-1] in frequencies:
+            frequencies[word[:-1]] += frequencies.pop(word)
+    return frequencies
@@ -0,0 +1,41 @@
+import io
+import base64
+
+
+PNG_URI_PREFIX = "data:image/png;base64,"
+
+
+def pngToUri(png):
+    ''' Encodes png bytes as a data uri, ready to be sent as an img src. '''
+    return PNG_URI_PREFIX + base64.b64encode(png).decode("ascii")
+
+
+def uriToPng(uri):
+    ''' Returns the png bytes of a data uri made by pngToUri. '''
+    return base64.b64decode(uri[len(PNG_URI_PREFIX):])
+
+
+def encodeImage(image):
+    ''' Encodes a PIL image as a png data uri. '''
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return pngToUri(buffer.getvalue())
+
+
+def renderWordcloud(frequencies):
+    ''' Renders a {word: count} dict as a png data uri ("" if it is empty).
+        Runs in the wordcloud worker processes, so it only gets plain data.
+    '''
+    if len(frequencies) == 0:
+        return ""
+    # imported on first use, so only the worker processes load them
+    from wordcloud import WordCloud
+    import matplotlib.colors as mcolors
+    wordcloud = WordCloud(
+        width=1200,
+        height=600,
+        background_color="white",
+        mode="RGBA",
+        colormap=mcolors.LinearSegmentedColormap.from_list('custom colormap', ['#47A8BD', '#FFAD69'], N=2)
+    ).generate_from_frequencies(frequencies)
+    return encodeImage(wordcloud.to_image())